@@ -0,0 +1,55 @@
+import sys
+import time
+import pickle
+import argparse
+import numpy as np
+
+from sailor.utils.dirscan import find_path
+from sailor.process.forest import CompiledForest
+
+
+def time_call(func, X, repeat):
+    func(X)
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(X)
+
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the compiled forest with sklearn's predict")
+    parser.add_argument("model_file", nargs="?", default="model.p")
+    parser.add_argument("--samples", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    model_path = find_path(args.model_file) or args.model_file
+    model = pickle.load(open(model_path, "rb"))["model"]
+    compiled = CompiledForest.from_sklearn(model)
+
+    # Hand features are landmark offsets inside the unit square
+    rng = np.random.default_rng(0)
+    X = rng.random((args.samples, model.n_features_in_), dtype=np.float32) * 0.5
+
+    labels_match = np.array_equal(compiled.predict(X), model.predict(X))
+    proba_error = np.abs(compiled.predict_proba(X) - model.predict_proba(X)).max()
+
+    print(f"model: {model_path}")
+    print(f"trees: {compiled.n_estimators}, nodes: {len(compiled.feature)}, max depth: {compiled.max_depth}")
+    print(f"labels match: {labels_match}, max probability error: {proba_error:.3g}")
+
+    for batch in (1, 2, 64):
+        sklearn_time = time_call(model.predict, X[:batch], args.repeat)
+        compiled_time = time_call(compiled.predict, X[:batch], args.repeat)
+
+        print(f"batch {batch:>3}: sklearn {sklearn_time * 1e6:9.1f} us, "
+              f"compiled {compiled_time * 1e6:9.1f} us, "
+              f"speedup {sklearn_time / compiled_time:6.1f}x")
+
+    return 0 if labels_match else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
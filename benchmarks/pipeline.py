@@ -0,0 +1,305 @@
+import os
+import sys
+import json
+import time
+import types
+import platform
+import argparse
+import tracemalloc
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from sailor.process.camera import cv2, open_source
+from sailor.process.profiler import profiler
+from sailor.process.encoder import PreviewEncoder
+from sailor.process.pipeline import tracked_results
+
+
+def install_fake_pyautogui(screen_width: int = 1920, screen_height: int = 1080):
+    # The real module needs a display, the benchmark only counts the calls
+    pyautogui = types.ModuleType("pyautogui")
+    pyautogui.calls = {"moveTo": 0, "click": 0}
+
+    def move_to(x, y, _pause=True):
+        pyautogui.calls["moveTo"] += 1
+
+    def click(_pause=True):
+        pyautogui.calls["click"] += 1
+
+    pyautogui.size = lambda: (screen_width, screen_height)
+    pyautogui.moveTo = move_to
+    pyautogui.click = click
+
+    sys.modules["pyautogui"] = pyautogui
+
+    return pyautogui
+
+
+def synthetic_landmarks(frames: int, hands: int = 1, seed: int = 0):
+    rng = np.random.default_rng(seed)
+
+    # Wrist plus four joints along five fanned out fingers
+    angles = np.linspace(-0.9, 0.9, 5)
+    lengths = np.array([0.25, 0.45, 0.6, 0.7])
+    template = np.zeros((21, 3), np.float32)
+    template[1:, 0] = (np.sin(angles)[:, None] * lengths).ravel()
+    template[1:, 1] = (-np.cos(angles)[:, None] * lengths).ravel()
+
+    landmarks = np.empty((frames, hands, 21, 3), np.float32)
+    t = np.arange(frames) / 30.0
+
+    for hand in range(hands):
+        phase = rng.uniform(0, 2 * np.pi, 2)
+        center = np.stack((0.5 + 0.25 * np.sin(0.7 * t + phase[0]),
+                           0.6 + 0.15 * np.sin(1.1 * t + phase[1])), axis=1)
+        curl = 0.5 + 0.5 * np.sin(0.9 * t + phase[0])
+
+        landmarks[:, hand] = template * (0.15 * (1 - 0.5 * curl))[:, None, None]
+        landmarks[:, hand, :, :2] += center[:, None]
+        landmarks[:, hand] += rng.normal(0, 0.002, (frames, 21, 3))
+
+    return landmarks.clip(0, 1)
+
+
+class ReplayHands:
+    def __init__(self, landmarks):
+        self.landmarks = landmarks
+        self.handedness = [(index, 0.99, ("Right", "Left")[index % 2])
+                           for index in range(landmarks.shape[1])]
+        self.frame_index = 0
+
+    def process(self, image):
+        landmarks = self.landmarks[self.frame_index % len(self.landmarks)]
+        self.frame_index += 1
+
+        return tracked_results(landmarks, self.handedness)
+
+    def close(self):
+        pass
+
+
+def max_rss_mb():
+    if resource is None:
+        return None
+
+    # Kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def build_scenario(name, args):
+    from sailor.process.tracker import Tracker
+    from sailor.process.classifier import Classifier
+    from sailor.process.controls import Controls
+
+    source = open_source(args.clip or "synthetic", realtime=False)
+    camera_kwargs = {"source": source, "cap_threaded": False}
+
+    if name == "tracker":
+        obj = Tracker(**camera_kwargs)
+        step = obj.track_hands
+
+    elif name == "classifier":
+        obj = Classifier(model_file=args.model, **camera_kwargs)
+        step = obj.predict_hands
+
+    else:
+        obj = Controls(activate=True, model_file=args.model, **camera_kwargs)
+        encoder = PreviewEncoder(args.quality, args.format)
+
+        def step(frame):
+            obj.hands_control(frame)
+            preview = obj.render_overlay(frame, min(1.0, args.preview_width / frame.shape[1]))
+
+            # Encoded inline so the stage shows up in the frame time
+            with profiler.span("encode"):
+                encoder.encode(preview)
+
+    obj.model_hands.close()
+
+    if name in ("classifier", "controls"):
+        obj.model_hands = ReplayHands(synthetic_landmarks(args.frames, args.hands))
+    else:
+        obj.max_num_hands = args.hands
+        obj.model_hands = obj.build_hands()
+
+    # Skipped frames would hide changes to the tracking stages
+    obj.set_adaptive_inference(args.adaptive)
+
+    return obj, step
+
+
+def run_frames(obj, step, frames):
+    for _ in range(frames):
+        frame = obj.process()
+        if frame is None:
+            break
+
+        result = step(frame)
+
+        # Tracker and Classifier stages are context managers
+        if hasattr(result, "__enter__"):
+            with result:
+                pass
+
+
+def run_scenario(name, args):
+    obj, step = build_scenario(name, args)
+
+    run_frames(obj, step, args.warmup)
+    profiler.reset()
+
+    start = time.perf_counter()
+    run_frames(obj, step, args.frames)
+    elapsed = time.perf_counter() - start
+
+    stages = profiler.summary()
+
+    # Tracing slows every allocation down, so it gets its own shorter pass
+    tracemalloc.start()
+    blocks_before = sys.getallocatedblocks()
+    current_before, _ = tracemalloc.get_traced_memory()
+
+    run_frames(obj, step, args.alloc_frames)
+
+    current_after, peak = tracemalloc.get_traced_memory()
+    blocks_after = sys.getallocatedblocks()
+    tracemalloc.stop()
+
+    if hasattr(obj, "actuator"):
+        obj.actuator.stop()
+
+    obj.close_hands()
+    obj.cap.release()
+
+    return {"frames": args.frames,
+            "fps": args.frames / elapsed,
+            "frame_ms": elapsed / args.frames * 1000,
+            "stages": stages,
+            "max_rss_mb": max_rss_mb(),
+            "traced_peak_kb": (peak - current_before) / 1024,
+            "retained_kb_per_frame": (current_after - current_before) / 1024 / args.alloc_frames,
+            "blocks_per_frame": (blocks_after - blocks_before) / args.alloc_frames}
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+
+    for name, scenario in results["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name)
+        if base is None:
+            continue
+
+        change = scenario["fps"] / base["fps"] - 1
+        print(f"{name:>10}: {base['fps']:8.1f} -> {scenario['fps']:8.1f} fps ({change:+.1%})")
+
+        if change < -tolerance:
+            regressions.append(f"{name} fps")
+
+        for stage, stats in scenario["stages"].items():
+            base_stats = base["stages"].get(stage)
+            if base_stats is None or base_stats["p50_ms"] <= 0:
+                continue
+
+            change = stats["p50_ms"] / base_stats["p50_ms"] - 1
+            if change > tolerance:
+                regressions.append(f"{name} {stage} p50 {change:+.1%}")
+
+    return regressions
+
+
+def record_fixture(args):
+    source = open_source(args.record_source, realtime=False)
+    os.makedirs(args.record, exist_ok=True)
+    recorded = 0
+
+    for index in range(args.frames):
+        success, frame = source.read()
+        if not success:
+            break
+
+        cv2.imwrite(os.path.join(args.record, f"{index:05d}.png"), frame)
+        recorded += 1
+
+    source.release()
+    print(f"recorded {recorded} frames to {args.record}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the vision pipeline on recorded or synthetic input")
+    parser.add_argument("scenarios", nargs="*", default=["tracker", "classifier", "controls", "pipeline"],
+                        help="tracker, classifier, controls (synthetic landmarks) or pipeline (MediaPipe on the clip)")
+    parser.add_argument("--clip", help="video file or image directory, synthetic frames when omitted")
+    parser.add_argument("--model", default="model.smb")
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--warmup", type=int, default=30)
+    parser.add_argument("--alloc-frames", type=int, default=50)
+    parser.add_argument("--hands", type=int, default=1)
+    parser.add_argument("--quality", type=int, default=80)
+    parser.add_argument("--preview-width", type=int, default=640)
+    parser.add_argument("--format", default="jpeg", help="preview format, jpeg or webp")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="let the scheduler skip tracking on steady frames")
+    parser.add_argument("--output", help="write the results as JSON")
+    parser.add_argument("--baseline", help="compare against an earlier JSON result")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    parser.add_argument("--record", help="record a clip fixture into this image directory and exit")
+    parser.add_argument("--record-source", default="0")
+    args = parser.parse_args()
+
+    if args.record:
+        record_fixture(args)
+        return 0
+
+    install_fake_pyautogui()
+
+    import mediapipe
+    import sklearn
+
+    results = {"meta": {"time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                        "python": platform.python_version(),
+                        "platform": platform.platform(),
+                        "processor": platform.processor(),
+                        "cpu_count": os.cpu_count(),
+                        "numpy": np.__version__,
+                        "opencv": cv2.__version__,
+                        "mediapipe": mediapipe.__version__,
+                        "sklearn": sklearn.__version__,
+                        "clip": args.clip or "synthetic",
+                        "model": args.model,
+                        "hands": args.hands},
+               "scenarios": {}}
+
+    for name in args.scenarios:
+        scenario = run_scenario(name, args)
+        results["scenarios"][name] = scenario
+
+        print(f"{name:>10}: {scenario['fps']:8.1f} fps, {scenario['frame_ms']:6.2f} ms/frame, "
+              f"rss {scenario['max_rss_mb'] or 0:.0f} MB, "
+              f"{scenario['blocks_per_frame']:+.1f} blocks/frame")
+
+        for stage, stats in scenario["stages"].items():
+            print(f"{stage:>24}: p50 {stats['p50_ms']:7.2f}  p95 {stats['p95_ms']:7.2f}  "
+                  f"p99 {stats['p99_ms']:7.2f} ms")
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.tolerance)
+
+        for regression in regressions:
+            print(f"regression: {regression}")
+
+        return 1 if regressions else 0
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
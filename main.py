@@ -1,5 +1,22 @@
+import time
+import argparse
+import multiprocessing
 import sailor as slr
 
+# Subpackages load lazily, so the app import below is all inside this window
+started = time.perf_counter()
+
+# The reloader's server process imports this file as __mp_main__ and needs the app, the
+# spawned pipeline workers (named sailor-<stage>) import it too and must not open it
+pipeline_worker = multiprocessing.current_process().name.startswith("sailor-")
+
+if __name__ in {"__main__", "__mp_main__"} and not pipeline_worker:
+    parser = argparse.ArgumentParser(description="Run the Screen Sailor web app.")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="report how long the app takes to import, serve and load the vision stack")
+    args = parser.parse_args()
+
+    if args.profile_startup:
+        slr.ng.app.profile_startup(started)
 
-if __name__ in {"__main__", "__mp_main__"}:
     slr.ng.app.launch()
@@ -1,4 +1,11 @@
-from .db import models
-from .ng import app, comps, config
-from .process import camera, classifier, controls, tracker
-from .utils import device, dirscan
+import importlib
+
+__all__ = ["db", "ng", "process", "utils"]
+
+
+def __getattr__(name):
+    # Subpackages load on first use, importing one does not pull in the others
+    if name in __all__:
+        return importlib.import_module(f".{name}", __name__)
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
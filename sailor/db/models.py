@@ -1,4 +1,39 @@
+import os
+import hmac
+import asyncio
 import sqlite3
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+hash_algorithm = "pbkdf2_sha256"
+
+
+def hash_password(password: str, iterations: int, salt: bytes = None):
+    salt = salt if salt is not None else os.urandom(16)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+
+    return f"{hash_algorithm}${iterations}${salt.hex()}${digest.hex()}"
+
+
+def check_password(password: str, stored: str):
+    try:
+        algorithm, iterations, salt, digest = stored.split("$")
+    except ValueError:
+        algorithm = None
+
+    if algorithm != hash_algorithm:
+        # Accounts created before hashing still hold the plain password
+        return hmac.compare_digest(password.encode(), stored.encode())
+
+    candidate = hash_password(password, int(iterations), bytes.fromhex(salt))
+
+    return hmac.compare_digest(candidate.encode(), stored.encode())
+
+
+def needs_rehash(stored: str, iterations: int):
+    return not stored.startswith(f"{hash_algorithm}${iterations}$")
 
 
 class Users:
@@ -10,6 +45,9 @@ class Users:
                     password TEXT NOT NULL
                 )
         """
+    create_username_index_query = """
+        CREATE UNIQUE INDEX IF NOT EXISTS users_username ON users (username)
+        """
 
     def __new__(cls, *args, **kwargs):
         if cls.instance is None:
@@ -17,30 +55,73 @@ class Users:
             return cls.instance
         return cls.instance
 
-    def __init__(self, db_name: str):
+    def __init__(self, db_name: str, hash_iterations: int = 600_000, hash_workers: int = 2):
         self.name = db_name
-        self.conn = self.__connect()
-        self.cursor = self.conn.cursor()
-        self.cursor.execute(self.create_users_query)
+        self.hash_iterations = hash_iterations
+        self.unknown_user_hash = None
+        self.unknown_user_lock = threading.Lock()
+
+        # sqlite3 connections are bound to their thread, each thread opens its own
+        self.local = threading.local()
+        self.connections = []
+        self.connections_lock = threading.Lock()
+
+        # Hashing is deliberately slow, it runs here instead of on the event loop
+        self.executor = ThreadPoolExecutor(hash_workers, thread_name_prefix="sailor-users")
+
+        conn = self.connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(self.create_users_query)
+
+        try:
+            conn.execute(self.create_username_index_query)
+        except sqlite3.IntegrityError as e:
+            raise Exception(
+                f"Duplicate usernames in {self.name}, remove them before starting. {e}")
+
+        conn.commit()
 
     def __connect(self):
         try:
-            return sqlite3.connect(self.name)
+            # Only the owning thread queries it, close() may come from another
+            conn = sqlite3.connect(self.name, timeout=10, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            return conn
 
         except sqlite3.Error as e:
             raise Exception(
                 f"An error occured while connecting to the Users. {e}")
 
-    def fetch_users_data(self):
-        all_users_info_query = """
-            SELECT username, password FROM users
+    def connection(self):
+        conn = getattr(self.local, "conn", None)
+
+        if conn is None:
+            conn = self.local.conn = self.__connect()
+
+            with self.connections_lock:
+                self.connections.append(conn)
+
+        return conn
+
+    def get_unknown_user_hash(self):
+        # Hashed on the first unknown login in the executor, not at import
+        with self.unknown_user_lock:
+            if self.unknown_user_hash is None:
+                self.unknown_user_hash = hash_password("", self.hash_iterations)
+
+            return self.unknown_user_hash
+
+    def fetch_password(self, username):
+        user_password_query = """
+            SELECT password FROM users WHERE username = ?
         """
 
-        self.cursor.execute(all_users_info_query)
+        row = self.connection().execute(user_password_query, (username,)).fetchone()
 
-        result = self.cursor.fetchall()
+        return row[0] if row is not None else None
 
-        return result
+    def user_exists(self, username):
+        return self.fetch_password(username) is not None
 
     def insert_user(self, username, password):
         insert_user_query = """
@@ -48,13 +129,60 @@ class Users:
                 VALUES (?, ?)
             """
 
+        conn = self.connection()
+
         try:
-            self.cursor.execute(insert_user_query, (username, password))
-            self.conn.commit()
+            with conn:
+                conn.execute(insert_user_query,
+                             (username, hash_password(password, self.hash_iterations)))
+
+        except sqlite3.IntegrityError:
+            # The unique index settles sign ups racing for the same name
+            return False
 
         except sqlite3.Error as e:
             raise Exception(f"An error occured while creating a user. {e}")
 
+        return True
+
+    def verify_user(self, username, password):
+        update_password_query = """
+            UPDATE users SET password = ? WHERE username = ?
+        """
+
+        stored = self.fetch_password(username)
+
+        if stored is None:
+            # Unknown names take as long as wrong passwords
+            check_password(password, self.get_unknown_user_hash())
+            return False
+
+        if not check_password(password, stored):
+            return False
+
+        if needs_rehash(stored, self.hash_iterations):
+            conn = self.connection()
+
+            with conn:
+                conn.execute(update_password_query,
+                             (hash_password(password, self.hash_iterations), username))
+
+        return True
+
+    async def run(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    async def user_exists_async(self, username):
+        return await self.run(self.user_exists, username)
+
+    async def insert_user_async(self, username, password):
+        return await self.run(self.insert_user, username, password)
+
+    async def verify_user_async(self, username, password):
+        return await self.run(self.verify_user, username, password)
+
     def __del__(self):
-        self.cursor.close()
-        self.conn.close()
+        self.executor.shutdown(wait=False)
+
+        for conn in self.connections:
+            conn.close()
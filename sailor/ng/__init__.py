@@ -1 +1,10 @@
-from . import app, comps, config
+import importlib
+
+__all__ = ["app", "comps", "config", "stream"]
+
+
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module(f".{name}", __name__)
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,23 +1,31 @@
 import os
 import re
+import sys
+import time
 import uuid
 
 from typing import Dict
-from nicegui import app, ui
+from nicegui import Client, app, background_tasks, ui
 from fastapi import Request
-from fastapi.responses import RedirectResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, RedirectResponse
 from starlette.middleware.sessions import SessionMiddleware
 
 from sailor.ng.comps import *
+from sailor.ng.stream import open_stream, stream_response
 from sailor.db.models import Users
-from sailor.process.controls import Controls
-from sailor.utils.dirscan import find_path
-from sailor.utils.device import cap_device_list
+from sailor.process.engine import Engine
+from sailor.process.profiler import profiler
+from sailor.process.resources import resources
+from sailor.utils.dirscan import find_path, project_root
+from sailor.utils.device import device_registry
 
 
 db_name = "users.db"
-db_path = find_path(db_name)
-db_model = Users(db_path)
+# A fresh clone has no database yet, Users creates it next to main.py
+db_path = find_path(db_name) or os.path.join(project_root, db_name)
+db_model = Users(db_path,
+                 hash_iterations=config["users"]["hash_iterations"],
+                 hash_workers=config["users"]["hash_workers"])
 
 
 app.add_middleware(SessionMiddleware,
@@ -25,20 +33,116 @@ app.add_middleware(SessionMiddleware,
 
 session_info: Dict[str, Dict] = {}
 
+device_registry.ttl = config["devices"]["ttl"]
+device_registry.poll_interval = config["devices"]["poll_interval"]
+
+profiler.enabled = config["profiler"]["enabled"]
+profiler.capacity = config["profiler"]["capacity"]
+
+engine = Engine(pipeline_stages=config["engine"]["pipeline_stages"],
+                preview_quality=config["stream"]["quality"],
+                preview_width=config["stream"]["width"],
+                preview_format=config["stream"]["format"],
+                encoder_workers=config["stream"]["encoder_workers"],
+                idle_timeout=config["engine"]["idle_timeout"])
+preview_stream_id = "sailor"
+preview_stream = open_stream(preview_stream_id, config["stream"]["max_fps"],
+                             engine.encoder.content_type)
+
+engine.add_preview_sink(preview_stream.publish,
+                        lambda: preview_stream.has_subscribers)
+
+
+def profile_startup(started: float):
+    imported = time.perf_counter()
+    profiler.record("startup_import", started, imported)
+
+    def report_server():
+        serving = time.perf_counter()
+        profiler.record("startup_server", started, serving)
+
+        vision_modules = [name for name in ("cv2", "mediapipe", "sklearn", "pyautogui")
+                          if name in sys.modules]
+
+        print(f"startup: app imported in {(imported - started) * 1000:.0f} ms, "
+              f"serving after {(serving - started) * 1000:.0f} ms, "
+              f"vision modules loaded: {', '.join(vision_modules) or 'none'}")
+
+    async def report_engine():
+        try:
+            await engine.wait_ready()
+        except Exception as e:
+            print(f"startup: {e}")
+            return
+
+        engine_start = profiler.summary()["engine_start"]
+        print(f"startup: engine ready after {engine_start['max_ms']:.0f} ms on its own thread")
+
+    app.on_startup(report_server)
+    app.on_startup(report_engine)
+
+
+def dump_profiler_trace():
+    if config["profiler"]["trace_file"]:
+        profiler.dump_chrome_trace(config["profiler"]["trace_file"])
+
+
+async def hold_engine(client: Client):
+    # The page holds the engine until its tab goes away, or until it never connects
+    client.on_disconnect(engine.release)
+
+    try:
+        await client.connected(timeout=30)
+    except TimeoutError:
+        engine.release()
+
+
+if config["engine"]["idle_timeout"] <= 0:
+    # Without an idle timeout the engine runs for the whole process
+    app.on_startup(engine.start)
+
+app.on_startup(device_registry.refresh)
+app.on_startup(device_registry.start_polling)
+app.on_startup(lambda: profiler.monitor_event_loop(config["profiler"]["loop_lag_interval"]))
+app.on_shutdown(engine.stop)
+# Open preview responses end instead of holding up the server shutdown
+app.on_shutdown(preview_stream.close)
+app.on_shutdown(device_registry.stop_polling)
+app.on_shutdown(dump_profiler_trace)
+app.on_shutdown(resources.report_leaks)
+
 
 def is_authenticated(request: Request) -> bool:
     return session_info.get(request.session.get("id"), {}).get("authenticated", False)
 
 
-@ui.page("/")
-def main_page(request: Request):
-    def update_frame():
-        frame = controls.process()
-        frame = controls.hands_control(frame)
-        frame = controls.as_base64(frame)
+@app.get("/stream/{stream_id}")
+def video_stream(request: Request, stream_id: str):
+    if not is_authenticated(request):
+        return RedirectResponse("/login")
 
-        cam_stream.source = frame
+    return stream_response(stream_id)
 
+
+@app.get("/metrics")
+def metrics(request: Request):
+    if not is_authenticated(request):
+        return RedirectResponse("/login")
+
+    return PlainTextResponse(profiler.metrics_text() + resources.metrics_text() +
+                             engine.metrics_text())
+
+
+@app.get("/trace")
+def trace(request: Request):
+    if not is_authenticated(request):
+        return RedirectResponse("/login")
+
+    return JSONResponse(profiler.chrome_trace())
+
+
+@ui.page("/", response_timeout=30)
+async def main_page(request: Request, client: Client):
     def try_edit():
         pass
 
@@ -47,9 +151,17 @@ def main_page(request: Request):
 
     session = session_info[request.session["id"]]
 
-    controls = Controls()
+    await engine.acquire_async()
+    background_tasks.create(hold_engine(client))
 
-    ui.timer(interval=0.05, callback=update_frame)
+    try:
+        await engine.wait_ready(config["engine"]["start_timeout"])
+    except Exception as e:
+        with page_settings():
+            ui.label(f"The camera could not be started, reload to try again. {e}")
+        return
+
+    controls = engine.settings
 
     with page_settings():
         with landing_header():
@@ -64,9 +176,10 @@ def main_page(request: Request):
                 with ui.expansion("Camera", icon=camera_icon, value=True).style(card_color):
                     with card():
                         ui.separator()
-                        cam_stream = ui.interactive_image().style(
+                        cam_stream = ui.interactive_image(f"/stream/{preview_stream_id}").style(
                             f"width: 640px; height: 480px; border: 1px solid {primary};")
-                        camera_index_select(cap_device_list, controls)
+                        camera_index_select(device_registry, controls,
+                                            config["devices"]["poll_interval"] or 2.0)
 
                 with ui.column():
                     with ui.expansion("Camera settings", icon=camera_settings_icon, value=True).style(card_color):
@@ -113,6 +226,14 @@ def main_page(request: Request):
                                                                gamma_slider,
                                                                flip_image_checkbox)
 
+                            camera_effective_settings(controls,
+                                                      {"cap_brightness": brightness_slider,
+                                                       "cap_contrast": contrast_slider,
+                                                       "cap_hue": hue_slider,
+                                                       "cap_saturation": saturation_slider,
+                                                       "cap_sharpness": sharpness_slider,
+                                                       "cap_gamma": gamma_slider})
+
                     with ui.expansion("Tracker settings", icon=tracker_settings_icon, value=True).style(card_color):
                         with card():
                             ui.separator()
@@ -126,14 +247,64 @@ def main_page(request: Request):
                                 track_con_slider = model_track_con_slider(
                                     controls)
 
-                            with inline_row("2", "1", "15px"):
+                            with inline_row("1", "1", "15px"):
                                 complexity_select = model_complexity_select(
                                     controls)
 
-                                default_model_settings_button(controls,
-                                                              detec_con_slider,
-                                                              track_con_slider,
-                                                              complexity_select)
+                                max_hands_select = model_max_hands_select(
+                                    controls)
+
+                            default_model_settings_button(controls,
+                                                          detec_con_slider,
+                                                          track_con_slider,
+                                                          complexity_select,
+                                                          max_hands_select)
+
+                    with ui.expansion("Scheduler settings", icon=scheduler_settings_icon, value=True).style(card_color):
+                        with card():
+                            ui.separator()
+                            with inline_row("1", "1", "15px"):
+                                ui.label("Target fps")
+                                fps_slider = target_fps_slider(controls)
+
+                            with inline_row("1", "1", "15px"):
+                                ui.label("CPU budget")
+                                budget_slider = cpu_budget_slider(controls)
+
+                            with inline_row("1", "1", "15px"):
+                                ui.label("Max tracker stride")
+                                inference_stride_slider = max_inference_stride_slider(
+                                    controls)
+
+                            with inline_row("1", "1", "15px"):
+                                ui.label("Motion threshold")
+                                motion_slider = motion_threshold_slider(
+                                    controls)
+
+                            with inline_row("1", "1", "15px"):
+                                ui.label("Crop padding")
+                                padding_slider = roi_padding_slider(controls)
+
+                            with inline_row("1", "1", "15px"):
+                                ui.label("Crop size")
+                                crop_size_slider = roi_size_slider(controls)
+
+                            with inline_row("1", "1", "15px"):
+                                adaptive_checkbox = adaptive_inference_checkbox(
+                                    controls)
+
+                                roi_checkbox = roi_inference_checkbox(
+                                    controls)
+
+                            default_scheduler_settings_button(controls,
+                                                              adaptive_checkbox,
+                                                              fps_slider,
+                                                              budget_slider,
+                                                              inference_stride_slider,
+                                                              motion_slider,
+                                                              roi_checkbox,
+                                                              padding_slider,
+                                                              crop_size_slider)
 
                 with ui.expansion("Gesture settings", icon=gestures_settings_icon, value=True).style(card_color):
                     with card():
@@ -141,6 +312,43 @@ def main_page(request: Request):
                         gesture_model_files = gesture_model_files_upload(
                             controls)
 
+                        with inline_row("1", "2", "15px"):
+                            ui.label("Vote window")
+                            window_slider = gesture_window_slider(controls)
+
+                        with inline_row("1", "2", "15px"):
+                            ui.label("Press confidence")
+                            press_threshold_slider = gesture_press_threshold_slider(
+                                controls)
+
+                        with inline_row("1", "2", "15px"):
+                            ui.label("Release confidence")
+                            release_threshold_slider = gesture_release_threshold_slider(
+                                controls)
+
+                        with inline_row("1", "2", "15px"):
+                            ui.label("Min dwell (s)")
+                            min_dwell_slider = gesture_min_dwell_slider(
+                                controls)
+
+                        with inline_row("1", "2", "15px"):
+                            ui.label("Hold time (s)")
+                            hold_time_slider = gesture_hold_time_slider(
+                                controls)
+
+                        with inline_row("1", "2", "15px"):
+                            ui.label("Stable stride")
+                            stride_slider = classify_stable_stride_slider(
+                                controls)
+
+                        default_gesture_settings_button(controls,
+                                                        window_slider,
+                                                        press_threshold_slider,
+                                                        release_threshold_slider,
+                                                        min_dwell_slider,
+                                                        hold_time_slider,
+                                                        stride_slider)
+
                 with ui.column():
                     with ui.expansion("Controls settings", icon=controls_settings_icon, value=True).style(card_color):
                         with card():
@@ -150,12 +358,46 @@ def main_page(request: Request):
                                 frame_reduction_slider = controls_frame_reduction_slider(
                                     controls)
 
+                            filter_type_select = cursor_filter_type_select(
+                                controls)
+
+                            with inline_row("1", "2", "15px"):
+                                ui.label("Min cutoff")
+                                filter_min_cutoff_slider = cursor_filter_min_cutoff_slider(
+                                    controls)
+
+                            with inline_row("1", "2", "15px"):
+                                ui.label("Beta")
+                                filter_beta_slider = cursor_filter_beta_slider(
+                                    controls)
+
+                            with inline_row("1", "2", "15px"):
+                                ui.label("Alpha")
+                                filter_alpha_slider = cursor_filter_alpha_slider(
+                                    controls)
+
+                            with inline_row("1", "2", "15px"):
+                                ui.label("Process noise")
+                                filter_process_noise_slider = cursor_filter_process_noise_slider(
+                                    controls)
+
+                            with inline_row("1", "2", "15px"):
+                                ui.label("Measurement noise")
+                                filter_measurement_noise_slider = cursor_filter_measurement_noise_slider(
+                                    controls)
+
                             with inline_row("2.5", "1", "41px"):
                                 hands_control_checkbox = activate_hands_control_checkbox(
                                     controls)
                                 default_controls_settings_button(controls,
                                                                  hands_control_checkbox,
-                                                                 frame_reduction_slider)
+                                                                 frame_reduction_slider,
+                                                                 filter_type_select,
+                                                                 filter_min_cutoff_slider,
+                                                                 filter_beta_slider,
+                                                                 filter_alpha_slider,
+                                                                 filter_process_noise_slider,
+                                                                 filter_measurement_noise_slider)
 
                     with ui.expansion("Display settings", icon=display_settings_icon, value=True).style(card_color):
                         with card():
@@ -204,6 +446,12 @@ def main_page(request: Request):
                                                             hands_type_checkbox,
                                                             hands_sign_checkbox)
 
+                with ui.expansion("Profiler", icon=profiler_icon, value=False).style(card_color):
+                    with card():
+                        ui.separator()
+                        profiler_stats_table(engine.get_stage_stats)
+                        profiler_trace_button("/trace")
+
             with ui.tab_panel("Help").classes(tab_panel_classes):
                 ui.markdown("Help")
 
@@ -223,8 +471,8 @@ def main_page(request: Request):
 
 @ui.page("/login")
 def log_in(request: Request):
-    def try_log_in():
-        if (username.value, password.value) in db_model.fetch_users_data():
+    async def try_log_in():
+        if await db_model.verify_user_async(username.value, password.value):
             session_info[request.session["id"]] = {"username": username.value,
                                                    "authenticated": True}
             ui.notify("Logged in successfully",
@@ -298,19 +546,22 @@ def sign_up():
 
         return True
 
-    def try_sign_up():
-        if username.value not in list(map(lambda t: t[0], db_model.fetch_users_data())):
+    async def try_sign_up():
+        if not await db_model.user_exists_async(username.value):
             if check_passwords(first_password.value, second_password.value):
-                ui.notify("Signed up successfully",
-                          type="positive",
-                          position="bottom")
-                db_model.insert_user(username.value, first_password.value)
-                ui.open("/login")
-
-        else:
-            ui.notify("Username already taken",
-                      type="negative",
-                      position="bottom")
+                if await db_model.insert_user_async(username.value, first_password.value):
+                    ui.notify("Signed up successfully",
+                              type="positive",
+                              position="bottom")
+                    ui.open("/login")
+                    return
+
+            else:
+                return
+
+        ui.notify("Username already taken",
+                  type="negative",
+                  position="bottom")
 
     with page_settings():
         with landing_header():
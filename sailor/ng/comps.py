@@ -1,10 +1,12 @@
 import io
 import re
-import pickle
+import asyncio
 from nicegui import ui
 from sailor.ng.config import config
 from contextlib import contextmanager
 from nicegui.events import UploadEventArguments
+from sailor.process.bundle import read_bundle
+from sailor.utils.device import device_labels
 
 
 # Colors for components from config
@@ -28,6 +30,8 @@ tracker_settings_icon = "control_camera"
 gestures_settings_icon = "sign_language"
 controls_settings_icon = "mouse"
 display_settings_icon = "display_settings"
+scheduler_settings_icon = "speed"
+profiler_icon = "timer"
 user_info = "person_pin"
 logout_icon = "logout"
 
@@ -111,20 +115,45 @@ def cam_stream():
     return cam_stream
 
 
-def camera_index_select(cap_device_list: list, cam_obj: object):
+def camera_index_select(registry: object, cam_obj: object, interval: float = 2.0):
     ui.label("Camera sources")
 
-    options = cap_device_list
-    value = cap_device_list[0]
+    # Filled in once the registry has enumerated, which can take seconds
+    options = []
+    value = None
+    updating = [False]
 
-    def on_change():
-        return cam_obj.get_default_cap_settings(), cam_obj.set_cap_index(
+    async def on_change():
+        if updating[0] or index_select.value is None:
+            return
+
+        return await cam_obj.get_default_cap_settings(), cam_obj.set_cap_index(
             int(re.findall("[0-9]+", index_select.value)[0])), ui.notify("Camera settings have been set to default", type="info", position="bottom-left"),
 
+    async def update_options():
+        labels = device_labels(await registry.get_devices_async())
+        if labels == index_select.options:
+            return
+
+        updating[0] = True
+        index_select.options = labels
+        index_select.update()
+
+        if index_select.value is None:
+            current = f"{cam_obj.cap_source} - "
+            index_select.value = next((label for label in labels if label.startswith(current)), None)
+
+        updating[0] = False
+
     index_select = ui.select(
         options=options,
         value=value,
         on_change=on_change).style(card_color).classes("w-full")
+
+    # Cached reads are cheap, the registry refreshes itself when stale or polling
+    ui.timer(0, update_options, once=True)
+    ui.timer(interval, update_options)
+
     return index_select
 
 
@@ -240,9 +269,9 @@ def flip_camera_image_checkbox(cam_obj: object):
 
 
 def default_camera_settings_button(cam_obj: object, *args):
-    def on_click():
+    async def on_click():
         cam_obj.set_default_cap_settings()
-        for arg, prop in zip(args, cam_obj.get_default_cap_settings()):
+        for arg, prop in zip(args, await cam_obj.get_default_cap_settings()):
             if isinstance(prop, bool):
                 arg.set_value(bool(prop))
             else:
@@ -256,6 +285,16 @@ def default_camera_settings_button(cam_obj: object, *args):
     return camera_settings_button
 
 
+def camera_effective_settings(cam_obj: object, sliders: dict, interval: float = 1.0):
+    # Drivers clamp some values, the sliders follow what the camera actually applied
+    async def on_tick():
+        for name, value in (await cam_obj.get_effective_cap_settings()).items():
+            if name in sliders and sliders[name].value != value:
+                sliders[name].set_value(float(value))
+
+    return ui.timer(interval, on_tick)
+
+
 def model_detec_con_slider(tracker_obj: object):
     min = 0
     max = 1
@@ -307,9 +346,24 @@ def model_complexity_select(tracker_obj: object):
     return complexity_select
 
 
+def model_max_hands_select(tracker_obj: object):
+    options = [1, 2, 3, 4]
+    label = "Max hands"
+    value = tracker_obj.max_num_hands
+
+    def on_change(): return tracker_obj.set_model_max_cur_listhands(max_hands_select.value)
+
+    max_hands_select = ui.select(
+        options=options,
+        label=label,
+        value=value,
+        on_change=on_change).style(card_color).classes("w-full")
+    return max_hands_select
+
+
 def default_model_settings_button(tracker_obj: object, *args):
-    def on_click():
-        for arg, prop in zip(args, tracker_obj.setup_default_model_settings()):
+    async def on_click():
+        for arg, prop in zip(args, await tracker_obj.setup_default_model_settings()):
             if isinstance(prop, int):
                 arg.set_value(int(prop))
             else:
@@ -324,87 +378,336 @@ def default_model_settings_button(tracker_obj: object, *args):
     return model_settings_button
 
 
-def gesture_model_files_upload(classifier_obj: object):
-    def on_upload(e: UploadEventArguments):
-        p_pattern = r"\.p$"
+def adaptive_inference_checkbox(tracker_obj: object):
+    text = "Adaptive inference"
+    value = tracker_obj.adaptive_inference
+
+    def on_change():
+        tracker_obj.set_adaptive_inference(adaptive_checkbox.value)
+
+    adaptive_checkbox = ui.checkbox(
+        text=text,
+        value=value,
+        on_change=on_change)
+
+    return adaptive_checkbox
+
+
+def target_fps_slider(tracker_obj: object):
+    min = 5
+    max = 60
+    value = tracker_obj.target_fps
+
+    def on_change(): return tracker_obj.set_target_fps(
+        int(fps_slider.value))
+
+    fps_slider = ui.slider(
+        min=min,
+        max=max,
+        value=value,
+        on_change=on_change).props("label")
+    return fps_slider
+
+
+def cpu_budget_slider(tracker_obj: object):
+    min = 0.1
+    max = 1
+    step = 0.05
+    value = tracker_obj.cpu_budget
+
+    def on_change(): return tracker_obj.set_cpu_budget(
+        float(budget_slider.value))
+
+    budget_slider = ui.slider(
+        min=min,
+        max=max,
+        value=value,
+        step=step,
+        on_change=on_change).props("label")
+    return budget_slider
+
+
+def max_inference_stride_slider(tracker_obj: object):
+    min = 1
+    max = 8
+    value = tracker_obj.max_inference_stride
+
+    def on_change(): return tracker_obj.set_max_inference_stride(
+        int(stride_slider.value))
+
+    stride_slider = ui.slider(
+        min=min,
+        max=max,
+        value=value,
+        on_change=on_change).props("label")
+    return stride_slider
+
+
+def motion_threshold_slider(tracker_obj: object):
+    min = 0.05
+    max = 2
+    step = 0.05
+    value = tracker_obj.motion_threshold
+
+    def on_change(): return tracker_obj.set_motion_threshold(
+        float(threshold_slider.value))
 
-        p_model = re.search(p_pattern, e.name)
+    threshold_slider = ui.slider(
+        min=min,
+        max=max,
+        value=value,
+        step=step,
+        on_change=on_change).props("label")
+    return threshold_slider
 
-        if p_model:
-            model_string = e.content.read()
 
-            model_dict = pickle.loads(model_string)
+def roi_inference_checkbox(tracker_obj: object):
+    text = "Crop to hands"
+    value = tracker_obj.roi_inference
 
-            model = model_dict["model"]
+    def on_change():
+        tracker_obj.set_roi_inference(roi_checkbox.value)
 
-            classifier_obj.model = model
+    roi_checkbox = ui.checkbox(
+        text=text,
+        value=value,
+        on_change=on_change)
 
-            model_markdown.content = f"""
-            | <div style='width:303px'>Model file</div> |
-            | ----------------------------- |
-            | <center>{e.name}</center> |
-            """
+    return roi_checkbox
 
-        else:
-            labels_dict = {}
 
-            labels_string = e.content.read().decode("utf-8")
+def roi_padding_slider(tracker_obj: object):
+    min = 0.1
+    max = 1.5
+    step = 0.1
+    value = tracker_obj.roi_padding
 
-            label_lines = labels_string.strip().split("\n")
+    def on_change(): return tracker_obj.set_roi_padding(
+        float(padding_slider.value))
 
-            for label in label_lines:
-                parts = label.split(" ")
+    padding_slider = ui.slider(
+        min=min,
+        max=max,
+        value=value,
+        step=step,
+        on_change=on_change).props("label")
+    return padding_slider
 
-                key = int(parts[0])
-                value = parts[1].rstrip("\r")
 
-                labels_dict[key] = value
+def roi_size_slider(tracker_obj: object):
+    min = 128
+    max = 640
+    step = 32
+    value = tracker_obj.roi_size
 
-            classifier_obj.labels_dict = labels_dict
+    def on_change(): return tracker_obj.set_roi_size(
+        int(size_slider.value))
 
-            table_rows = []
-            for key, value in classifier_obj.labels_dict.items():
-                row = f"| <center>{key}</center> | <center>{value}</center> |"
-                table_rows.append(row)
+    size_slider = ui.slider(
+        min=min,
+        max=max,
+        value=value,
+        step=step,
+        on_change=on_change).props("label")
+    return size_slider
+
+
+def default_scheduler_settings_button(tracker_obj: object, *args):
+    async def on_click():
+        defaults = await tracker_obj.setup_default_scheduler_settings() + \
+            await tracker_obj.setup_default_roi_settings()
 
-            table_header = "| <div style='width:143px'>Index</div> | <div style='width:143px'>Label</div> |"
-            table_divider = "| ----- | ----- |"
+        for arg, prop in zip(args, defaults):
+            if isinstance(prop, bool):
+                arg.set_value(prop)
+            else:
+                arg.set_value(float(prop))
 
-            markdown_table = "\n".join(
-                [table_header, table_divider] + table_rows)
+        ui.notify("Scheduler settings have been set to default",
+                  type="info", position="bottom-left")
+
+    text = "Default"
+    scheduler_settings_button = ui.button(text=text,
+                                          on_click=on_click)
+    return scheduler_settings_button
 
-            labels_markdown_table.content = markdown_table
 
-    table_rows = []
-    for key, value in classifier_obj.labels_dict.items():
-        row = f"| <center>{key}</center> | <center>{value:<50}</center> |"
-        table_rows.append(row)
+def gesture_model_files_upload(classifier_obj: object):
+    def labels_table(labels_dict):
+        table_rows = []
+        for key, value in labels_dict.items():
+            row = f"| <center>{key}</center> | <center>{value}</center> |"
+            table_rows.append(row)
 
-    labels_table_header = "| <div style='width:143px'>Index</div> | <div style='width:143px'>Label</div> |"
-    labels_table_divider = "| ----- | ----- |"
+        table_header = "| <div style='width:143px'>Index</div> | <div style='width:143px'>Label</div> |"
+        table_divider = "| ----- | ----- |"
 
-    label_table = "\n".join(
-        [labels_table_header, labels_table_divider] + table_rows)
+        return "\n".join([table_header, table_divider] + table_rows)
 
-    model_table = f"""
-    | <div style='width:303px'>Model file</div> |
-    | ----------------------------- |
-    | <center>{classifier_obj.model_file}</center> |
-    """
+    def model_table(model_file):
+        return f"""
+        | <div style='width:303px'>Model file</div> |
+        | ----------------------------- |
+        | <center>{model_file}</center> |
+        """
+
+    async def on_upload(e: UploadEventArguments):
+        bundle_pattern = r"\.smb$"
+
+        if not re.search(bundle_pattern, e.name):
+            ui.notify("Only model bundles (.smb) can be uploaded, convert pickled models with sailor.process.bundle",
+                      type="negative", position="bottom-left")
+            return
+
+        bundle_bytes = e.content.read()
+
+        # Validation runs off the event loop so the stream keeps flowing
+        try:
+            bundle = await asyncio.get_running_loop().run_in_executor(
+                None, read_bundle, bundle_bytes)
+
+        except Exception as error:
+            ui.notify(str(error), type="negative", position="bottom-left")
+            return
+
+        classifier_obj.set_bundle(bundle, e.name)
+
+        model_markdown.content = model_table(e.name)
+        labels_markdown_table.content = labels_table(bundle.labels_dict)
+
+        ui.notify("Model bundle has been loaded", type="positive", position="bottom-left")
 
     model_markdown = ui.markdown(
-        model_table, extras=["tables"])
+        model_table(classifier_obj.model_file), extras=["tables"])
 
     labels_markdown_table = ui.markdown(
-        label_table, extras=["tables"])
+        labels_table(classifier_obj.labels_dict), extras=["tables"])
 
-    model_files_upload = ui.upload(label="Upload model and labels files",
-                                   multiple=True,
-                                   on_upload=on_upload).style(card_color).props("dense")
+    model_files_upload = ui.upload(label="Upload model bundle",
+                                   multiple=False,
+                                   on_upload=on_upload).style(card_color).props("dense accept=.smb")
 
     return model_files_upload
 
 
+def gesture_window_slider(classifier_obj: object):
+    min = 1
+    max = 15
+    value = classifier_obj.gesture_window
+
+    def on_change(): return classifier_obj.set_gesture_window(
+        int(window_slider.value))
+
+    window_slider = ui.slider(
+        min=min,
+        max=max,
+        value=value,
+        on_change=on_change).props("label")
+    return window_slider
+
+
+def gesture_press_threshold_slider(classifier_obj: object):
+    min = 0
+    max = 1
+    step = 0.05
+    value = classifier_obj.gesture_press_threshold
+
+    def on_change(): return classifier_obj.set_gesture_press_threshold(
+        float(press_threshold_slider.value))
+
+    press_threshold_slider = ui.slider(
+        min=min,
+        max=max,
+        value=value,
+        step=step,
+        on_change=on_change).props("label")
+    return press_threshold_slider
+
+
+def gesture_release_threshold_slider(classifier_obj: object):
+    min = 0
+    max = 1
+    step = 0.05
+    value = classifier_obj.gesture_release_threshold
+
+    def on_change(): return classifier_obj.set_gesture_release_threshold(
+        float(release_threshold_slider.value))
+
+    release_threshold_slider = ui.slider(
+        min=min,
+        max=max,
+        value=value,
+        step=step,
+        on_change=on_change).props("label")
+    return release_threshold_slider
+
+
+def gesture_min_dwell_slider(classifier_obj: object):
+    min = 0
+    max = 0.5
+    step = 0.02
+    value = classifier_obj.gesture_min_dwell
+
+    def on_change(): return classifier_obj.set_gesture_min_dwell(
+        float(min_dwell_slider.value))
+
+    min_dwell_slider = ui.slider(
+        min=min,
+        max=max,
+        value=value,
+        step=step,
+        on_change=on_change).props("label")
+    return min_dwell_slider
+
+
+def gesture_hold_time_slider(classifier_obj: object):
+    min = 0.1
+    max = 2
+    step = 0.1
+    value = classifier_obj.gesture_hold_time
+
+    def on_change(): return classifier_obj.set_gesture_hold_time(
+        float(hold_time_slider.value))
+
+    hold_time_slider = ui.slider(
+        min=min,
+        max=max,
+        value=value,
+        step=step,
+        on_change=on_change).props("label")
+    return hold_time_slider
+
+
+def classify_stable_stride_slider(classifier_obj: object):
+    min = 1
+    max = 4
+    value = classifier_obj.classify_stable_stride
+
+    def on_change(): return classifier_obj.set_classify_stable_stride(
+        int(stride_slider.value))
+
+    stride_slider = ui.slider(
+        min=min,
+        max=max,
+        value=value,
+        on_change=on_change).props("label")
+    return stride_slider
+
+
+def default_gesture_settings_button(classifier_obj: object, *args):
+    async def on_click():
+        for arg, prop in zip(args, await classifier_obj.setup_default_gesture_settings()):
+            arg.set_value(float(prop))
+
+        ui.notify("Gesture settings have been set to default",
+                  type="info", position="bottom-left")
+
+    text = "Default"
+    gesture_settings_button = ui.button(text=text,
+                                        on_click=on_click)
+    return gesture_settings_button
+
+
 def controls_frame_reduction_slider(controls_obj: object):
     min = 0
     max = 300
@@ -436,11 +739,118 @@ def activate_hands_control_checkbox(controls_obj: object):
     return hands_control_checkbox
 
 
+def cursor_filter_type_select(controls_obj: object):
+    options = {"one_euro": "One Euro",
+               "kalman": "Kalman",
+               "exponential": "Exponential",
+               "none": "None"}
+    label = "Cursor filter"
+    value = controls_obj.cursor_filter_type
+
+    def on_change(): return controls_obj.set_cursor_filter_type(
+        cursor_filter_select.value)
+
+    cursor_filter_select = ui.select(
+        options=options,
+        label=label,
+        value=value,
+        on_change=on_change).style(card_color).classes("w-full")
+    return cursor_filter_select
+
+
+def cursor_filter_min_cutoff_slider(controls_obj: object):
+    min = 0.1
+    max = 5
+    step = 0.1
+    value = controls_obj.cursor_filter_min_cutoff
+
+    def on_change(): return controls_obj.set_cursor_filter_min_cutoff(
+        float(min_cutoff_slider.value))
+
+    min_cutoff_slider = ui.slider(
+        min=min,
+        max=max,
+        value=value,
+        step=step,
+        on_change=on_change).props("label")
+    return min_cutoff_slider
+
+
+def cursor_filter_beta_slider(controls_obj: object):
+    min = 0
+    max = 0.05
+    step = 0.001
+    value = controls_obj.cursor_filter_beta
+
+    def on_change(): return controls_obj.set_cursor_filter_beta(
+        float(beta_slider.value))
+
+    beta_slider = ui.slider(
+        min=min,
+        max=max,
+        value=value,
+        step=step,
+        on_change=on_change).props("label")
+    return beta_slider
+
+
+def cursor_filter_alpha_slider(controls_obj: object):
+    min = 0.05
+    max = 1
+    step = 0.05
+    value = controls_obj.cursor_filter_alpha
+
+    def on_change(): return controls_obj.set_cursor_filter_alpha(
+        float(alpha_slider.value))
+
+    alpha_slider = ui.slider(
+        min=min,
+        max=max,
+        value=value,
+        step=step,
+        on_change=on_change).props("label")
+    return alpha_slider
+
+
+def cursor_filter_process_noise_slider(controls_obj: object):
+    min = 50
+    max = 5000
+    step = 50
+    value = controls_obj.cursor_filter_process_noise
+
+    def on_change(): return controls_obj.set_cursor_filter_process_noise(
+        float(process_noise_slider.value))
+
+    process_noise_slider = ui.slider(
+        min=min,
+        max=max,
+        value=value,
+        step=step,
+        on_change=on_change).props("label")
+    return process_noise_slider
+
+
+def cursor_filter_measurement_noise_slider(controls_obj: object):
+    min = 1
+    max = 50
+    value = controls_obj.cursor_filter_measurement_noise
+
+    def on_change(): return controls_obj.set_cursor_filter_measurement_noise(
+        float(measurement_noise_slider.value))
+
+    measurement_noise_slider = ui.slider(
+        min=min,
+        max=max,
+        value=value,
+        on_change=on_change).props("label")
+    return measurement_noise_slider
+
+
 def default_controls_settings_button(controls_obj: object, *args):
-    def on_click():
-        for arg, prop in zip(args, controls_obj.get_default_controls_settings()):
-            if isinstance(prop, bool):
-                arg.set_value(bool(prop))
+    async def on_click():
+        for arg, prop in zip(args, await controls_obj.get_default_controls_settings()):
+            if isinstance(prop, (bool, str)):
+                arg.set_value(prop)
             else:
                 arg.set_value(float(prop))
         ui.notify("Control settings have been set to default",
@@ -573,9 +983,9 @@ def overlay_hands_sign_checkbox(tracker_obj: object):
 
 
 def default_display_settings_button(tracker_obj: object, *args):
-    def on_click():
-        props = tracker_obj.setup_default_landmark_values(
-        ) + tracker_obj.setup_default_display_settings()
+    async def on_click():
+        props = await tracker_obj.setup_default_landmark_values(
+        ) + await tracker_obj.setup_default_display_settings()
 
         for arg, prop in zip(args, props):
             if isinstance(prop, bool):
@@ -590,3 +1000,32 @@ def default_display_settings_button(tracker_obj: object, *args):
     display_settings_button = ui.button(text=text,
                                         on_click=on_click)
     return display_settings_button
+
+
+def profiler_stats_table(get_stage_stats, interval: float = 1.0):
+    def stats_table():
+        table_rows = []
+        for stage, stats in get_stage_stats().items():
+            row = f"| {stage} | {stats['p50_ms']:.1f} | {stats['p95_ms']:.1f} | " \
+                  f"{stats['p99_ms']:.1f} | {stats['max_ms']:.1f} | {stats['count']} |"
+            table_rows.append(row)
+
+        table_header = "| Stage | p50 ms | p95 ms | p99 ms | Max ms | Count |"
+        table_divider = "| ----- | -----: | -----: | -----: | -----: | ----: |"
+
+        return "\n".join([table_header, table_divider] + table_rows)
+
+    def on_tick():
+        stats_markdown.content = stats_table()
+
+    stats_markdown = ui.markdown(stats_table(), extras=["tables"])
+    ui.timer(interval, on_tick)
+
+    return stats_markdown
+
+
+def profiler_trace_button(trace_url: str):
+    text = "Download trace"
+    trace_button = ui.button(text=text,
+                             on_click=lambda: ui.download(trace_url, "sailor-trace.json"))
+    return trace_button
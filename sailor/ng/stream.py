@@ -0,0 +1,101 @@
+import asyncio
+import threading
+
+from typing import Dict
+from fastapi.responses import Response, StreamingResponse
+
+
+boundary = "frame"
+
+streams: Dict[str, "FrameStream"] = {}
+
+
+class FrameStream:
+    def __init__(self, max_fps: float = 30.0, content_type: str = "image/jpeg"):
+        self.max_fps = max_fps
+        self.content_type = content_type
+
+        self.frame = None
+        self.frame_seq = 0
+        self.closed = False
+
+        self.lock = threading.Lock()
+        self.subscribers = set()
+
+    @property
+    def has_subscribers(self):
+        return bool(self.subscribers)
+
+    def publish(self, frame: bytes):
+        with self.lock:
+            self.frame = frame
+            self.frame_seq += 1
+            subscribers = list(self.subscribers)
+
+        # Publishers may run off the event loop, so wake subscribers thread-safely
+        for loop, event in subscribers:
+            loop.call_soon_threadsafe(event.set)
+
+    def close(self):
+        self.closed = True
+
+        with self.lock:
+            subscribers = list(self.subscribers)
+
+        for loop, event in subscribers:
+            loop.call_soon_threadsafe(event.set)
+
+    async def frames(self):
+        loop = asyncio.get_running_loop()
+        subscriber = (loop, asyncio.Event())
+
+        with self.lock:
+            self.subscribers.add(subscriber)
+
+        if self.frame is not None:
+            subscriber[1].set()
+
+        try:
+            frame_period = 1 / self.max_fps if self.max_fps > 0 else 0
+            next_frame_time = 0
+
+            while not self.closed:
+                await subscriber[1].wait()
+                subscriber[1].clear()
+
+                delay = next_frame_time - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+                next_frame_time = loop.time() + frame_period
+
+                # Always send the newest frame, frames published while waiting are dropped
+                frame = self.frame
+                if frame is None or self.closed:
+                    continue
+
+                yield b"--" + boundary.encode() + b"\r\n" \
+                    b"Content-Type: " + self.content_type.encode() + b"\r\n" \
+                    b"Content-Length: " + str(len(frame)).encode() + b"\r\n\r\n" + \
+                    frame + b"\r\n"
+
+        finally:
+            with self.lock:
+                self.subscribers.discard(subscriber)
+
+
+def open_stream(stream_id: str, max_fps: float = 30.0, content_type: str = "image/jpeg"):
+    stream = FrameStream(max_fps, content_type)
+    streams[stream_id] = stream
+    return stream
+
+
+def stream_response(stream_id: str):
+    stream = streams.get(stream_id)
+
+    if stream is None:
+        return Response(status_code=404)
+
+    return StreamingResponse(stream.frames(),
+                             media_type=f"multipart/x-mixed-replace; boundary={boundary}",
+                             headers={"Cache-Control": "no-store"})
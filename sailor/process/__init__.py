@@ -1 +1,11 @@
-from . import camera, classifier, controls, tracker
+import importlib
+
+__all__ = ["actuator", "bundle", "camera", "classifier", "controls", "encoder", "engine", "filters", "forest", "gestures", "overlay", "pipeline", "profiler", "resources", "scheduler", "tracker"]
+
+
+def __getattr__(name):
+    # The engine imports the vision modules when it starts, not when the app imports it
+    if name in __all__:
+        return importlib.import_module(f".{name}", __name__)
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
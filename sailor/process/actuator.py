@@ -0,0 +1,213 @@
+import time
+import logging
+import threading
+from collections import deque
+from sailor.process.profiler import profiler
+from sailor.process.resources import resources
+
+
+logger = logging.getLogger(__name__)
+
+
+class NullBackend:
+    def __init__(self, screen_width: int = 1920, screen_height: int = 1080, record: bool = True):
+        self.screen_width = screen_width
+        self.screen_height = screen_height
+        self.record = record
+
+        self.position = (0, 0)
+        self.events = []
+
+    def size(self):
+        return self.screen_width, self.screen_height
+
+    def move(self, x, y):
+        self.position = (x, y)
+
+        if self.record:
+            self.events.append(("move", x, y, time.perf_counter()))
+
+    def click(self):
+        if self.record:
+            self.events.append(("click", *self.position, time.perf_counter()))
+
+
+class PyAutoGuiBackend:
+    def __init__(self):
+        # Imported here so headless machines can run the pipeline with NullBackend
+        import pyautogui
+
+        self.pag = pyautogui
+
+    def size(self):
+        return self.pag.size()
+
+    def move(self, x, y):
+        self.pag.moveTo(x, y, _pause=False)
+
+    def click(self):
+        self.pag.click(_pause=False)
+
+
+class Actuator:
+    def __init__(self, backend=None, rate: float = 240.0, glide: float = 0.35, queue_size: int = 8):
+        self.backend = backend if backend is not None else PyAutoGuiBackend()
+        self.rate = rate
+        self.glide = glide
+
+        self.commands = deque()
+        self.commands_changed = threading.Condition()
+        self.queue_size = queue_size
+        self.target = None
+        self.target_captured = None
+        self.position = None
+
+        self.commands_dropped = 0
+        self.worker = None
+        self.stopped = threading.Event()
+
+    def start(self):
+        worker = self.worker
+        if worker is not None:
+            if worker.is_alive() and not self.stopped.is_set():
+                return
+
+            # A worker that outlived stop() finishes its backend call before another starts
+            worker.join()
+            self.worker = None
+            resources.release("actuator")
+
+        self.stopped.clear()
+        self.worker = threading.Thread(target=self.run,
+                                       name="sailor-actuator",
+                                       daemon=True)
+        self.worker.start()
+        resources.acquire("actuator")
+
+    def stop(self):
+        if self.worker is None:
+            return
+
+        self.stopped.set()
+        self.worker.join(timeout=1)
+
+        if self.worker.is_alive():
+            # Kept so start() waits for it instead of running two actuator threads
+            logger.warning("The actuator did not stop within 1s")
+            return
+
+        self.worker = None
+        resources.release("actuator")
+
+    def post(self, command):
+        with self.commands_changed:
+            while len(self.commands) >= self.queue_size:
+                # A newer target supersedes an older one, clicks are never dropped
+                oldest_move = next((queued for queued in self.commands if queued[0] == "move"), None)
+
+                if oldest_move is not None:
+                    self.commands.remove(oldest_move)
+                    self.commands_dropped += 1
+
+                elif self.worker is None or self.stopped.is_set():
+                    # Nothing drains the queue, waiting would block the caller for good
+                    self.commands_dropped += 1
+                    return
+
+                else:
+                    self.commands_changed.wait(0.1)
+
+            self.commands.append(command)
+            self.commands_changed.notify_all()
+
+    def take_commands(self, timeout):
+        with self.commands_changed:
+            if not self.commands:
+                self.commands_changed.wait(timeout)
+
+            commands = list(self.commands)
+            self.commands.clear()
+            self.commands_changed.notify_all()
+
+        return commands
+
+    def move_to(self, x, y, captured=None):
+        self.post(("move", x, y, captured))
+
+    def click(self):
+        self.post(("click",))
+
+    def move_backend(self, x, y):
+        move_start = time.perf_counter()
+        self.backend.move(round(x), round(y))
+        moved = time.perf_counter()
+
+        profiler.record("move", move_start, moved)
+
+        if self.target_captured is not None:
+            # Glass to cursor, from the frame read to the first step towards it
+            profiler.record("glass_to_cursor", self.target_captured, moved)
+            self.target_captured = None
+
+    def apply(self, command):
+        if command[0] == "move":
+            self.target = command[1], command[2]
+            self.target_captured = command[3]
+
+            if self.position is None:
+                self.position = self.target
+                self.move_backend(*self.position)
+
+        elif command[0] == "click":
+            if self.target is not None:
+                self.position = self.target
+                self.move_backend(*self.position)
+
+            with profiler.span("click"):
+                self.backend.click()
+
+    def is_idle(self):
+        return self.target is None or self.position == self.target
+
+    def tick(self):
+        if self.is_idle():
+            return
+
+        x, y = self.position
+        target_x, target_y = self.target
+
+        x += (target_x - x) * self.glide
+        y += (target_y - y) * self.glide
+
+        if abs(target_x - x) < 0.5 and abs(target_y - y) < 0.5:
+            x, y = self.target
+
+        self.position = x, y
+        self.move_backend(x, y)
+
+    def apply_safely(self, command):
+        try:
+            self.apply(command)
+        except Exception:
+            logger.exception("An error occured while applying the %s command", command[0])
+
+    def run(self):
+        next_tick = time.perf_counter()
+
+        while not self.stopped.is_set():
+            # Sleep on the queue while the cursor is at rest
+            timeout = 0.1 if self.is_idle() else max(next_tick - time.perf_counter(), 0)
+
+            for command in self.take_commands(timeout):
+                self.apply_safely(command)
+
+            now = time.perf_counter()
+            if now >= next_tick:
+                try:
+                    self.tick()
+                except Exception:
+                    # Gliding on would raise again every tick, wait for the next target
+                    logger.exception("An error occured while moving the cursor")
+                    self.target = self.position
+
+                next_tick = max(next_tick + 1 / self.rate, now)
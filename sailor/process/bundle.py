@@ -0,0 +1,207 @@
+import sys
+import json
+import pickle
+import struct
+import argparse
+import numpy as np
+from sailor.process.forest import CompiledForest
+
+
+magic = b"SAILORMB"
+version = 2
+# Version 1 stored the classes as an int64 array, later versions keep them in the header
+supported_versions = (1, 2)
+alignment = 64
+
+feature_schema = {"landmarks": 21,
+                  "coordinates": ["x", "y"],
+                  "layout": "interleaved",
+                  "origin": "hand_min"}
+
+array_names = ("feature", "threshold", "children", "leaf_values", "roots")
+
+array_dtypes = {"feature": np.int64,
+                "threshold": np.float64,
+                "children": np.int64,
+                "leaf_values": np.float64,
+                "roots": np.int64}
+
+
+class ModelBundle:
+    def __init__(self, model, labels_dict, header):
+        self.model = model
+        self.labels_dict = labels_dict
+        self.header = header
+
+
+def align(offset):
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def write_bundle(bundle_path, compiled, labels_dict):
+    arrays = {name: np.ascontiguousarray(getattr(compiled, name), array_dtypes[name])
+              for name in array_names}
+
+    header = {"version": version,
+              "format": "compiled_forest",
+              "n_features": compiled.n_features_in_,
+              "max_depth": compiled.max_depth,
+              "feature_schema": feature_schema,
+              # Classes keep their own type, string labels round trip as well as ints
+              "classes": np.asarray(compiled.classes_).tolist(),
+              "labels": {str(key): value for key, value in labels_dict.items()},
+              "arrays": {}}
+
+    # Array offsets depend on the header size, so lay them out until it settles
+    data_offset = 0
+    while True:
+        offset = data_offset
+        for name, array in arrays.items():
+            header["arrays"][name] = {"dtype": array.dtype.str,
+                                      "shape": list(array.shape),
+                                      "offset": offset}
+            offset = align(offset + array.nbytes)
+
+        header_bytes = json.dumps(header).encode("utf-8")
+        header_end = align(len(magic) + 4 + len(header_bytes))
+
+        if header_end == data_offset:
+            break
+
+        data_offset = header_end
+
+    with open(bundle_path, "wb") as bundle_file:
+        bundle_file.write(magic + struct.pack("<I", len(header_bytes)) + header_bytes)
+
+        for name, array in arrays.items():
+            bundle_file.seek(header["arrays"][name]["offset"])
+            bundle_file.write(array.tobytes())
+
+        bundle_file.truncate(offset)
+
+
+def parse_bundle(buffer):
+    buffer = np.frombuffer(buffer, np.uint8)
+
+    if buffer[:len(magic)].tobytes() != magic:
+        raise Exception("An error occured while reading the model bundle. Not a model bundle.")
+
+    header_length = struct.unpack("<I", buffer[len(magic):len(magic) + 4].tobytes())[0]
+    header = json.loads(buffer[len(magic) + 4:len(magic) + 4 + header_length].tobytes())
+
+    if header.get("version") not in supported_versions or header.get("format") != "compiled_forest":
+        raise Exception(
+            f"An error occured while reading the model bundle. Unsupported version {header.get('version')}.")
+
+    arrays = {}
+    for name in array_names + (("classes",) if header["version"] == 1 else ()):
+        spec = header["arrays"][name]
+        dtype = np.dtype(spec["dtype"])
+        count = int(np.prod(spec["shape"]))
+
+        if spec["offset"] + count * dtype.itemsize > len(buffer):
+            raise Exception(f"An error occured while reading the model bundle. Array {name} is truncated.")
+
+        # Views into the mapped file, nothing is copied
+        arrays[name] = np.frombuffer(buffer, dtype, count, spec["offset"]).reshape(spec["shape"])
+
+    classes = arrays["classes"] if header["version"] == 1 else np.asarray(header["classes"])
+
+    compiled = CompiledForest(arrays["feature"],
+                              arrays["threshold"],
+                              arrays["children"],
+                              arrays["leaf_values"],
+                              arrays["roots"],
+                              header["max_depth"],
+                              classes,
+                              header["n_features"])
+
+    # JSON keys are strings, they are matched back to the classes they label
+    class_keys = {str(label): label for label in classes.tolist()}
+    labels_dict = {class_keys.get(key, key): value for key, value in header["labels"].items()}
+
+    return ModelBundle(compiled, labels_dict, header)
+
+
+def validate_bundle(bundle):
+    model = bundle.model
+    nodes = len(model.feature)
+
+    checks = [
+        (model.threshold.shape == (nodes,), "threshold shape"),
+        (model.children.shape == (nodes, 2), "children shape"),
+        (model.leaf_values.shape == (nodes, len(model.classes_)), "leaf values shape"),
+        (bundle.header["feature_schema"] == feature_schema, "feature schema"),
+        (model.n_features_in_ == feature_schema["landmarks"] * len(feature_schema["coordinates"]), "feature count"),
+        (nodes > 0 and len(model.roots) > 0, "empty forest"),
+        (model.max_depth >= 0, "max depth"),
+        (((model.children >= 0) & (model.children < nodes)).all(), "children range"),
+        (((model.feature >= 0) & (model.feature < model.n_features_in_)).all(), "feature range"),
+        (((model.roots >= 0) & (model.roots < nodes)).all(), "roots range"),
+        (all(label in bundle.labels_dict for label in model.classes_.tolist()), "labels"),
+    ]
+
+    for passed, check in checks:
+        if not passed:
+            raise Exception(f"An error occured while validating the model bundle. Invalid {check}.")
+
+    # A smoke prediction catches anything the structural checks missed
+    model.predict(np.zeros((1, model.n_features_in_), np.float32))
+
+    return bundle
+
+
+def load_bundle(bundle_path):
+    return validate_bundle(parse_bundle(np.memmap(bundle_path, np.uint8, mode="r")))
+
+
+def read_bundle(bundle_bytes):
+    return validate_bundle(parse_bundle(bundle_bytes))
+
+
+def label_key(key):
+    # Integer classes are the common case, anything else is a string class
+    try:
+        return int(key)
+    except ValueError:
+        return key
+
+
+def read_labels(labels_path):
+    labels_dict = {}
+
+    with open(labels_path, "r") as labels:
+        for label in labels:
+            label = label.strip().split()
+            if label:
+                labels_dict[label_key(label[0])] = label[1]
+
+    return labels_dict
+
+
+def convert(model_path, labels_path, bundle_path):
+    # Pickles can run arbitrary code, only convert files you trust
+    with open(model_path, "rb") as model_file:
+        model = pickle.load(model_file)["model"]
+
+    write_bundle(bundle_path, CompiledForest.from_sklearn(model), read_labels(labels_path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a pickled gesture model and labels into a model bundle")
+    parser.add_argument("model_file")
+    parser.add_argument("labels_file")
+    parser.add_argument("-o", "--output", required=True)
+    args = parser.parse_args()
+
+    convert(args.model_file, args.labels_file, args.output)
+    bundle = load_bundle(args.output)
+
+    print(f"{args.output}: {len(bundle.model.roots)} trees, {len(bundle.model.feature)} nodes, "
+          f"labels {bundle.labels_dict}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
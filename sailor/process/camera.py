@@ -1,25 +1,486 @@
+import os
 import cv2
+import time
 import base64
+import logging
+import threading
 import numpy as np
+from sailor.process.profiler import profiler
+from sailor.process.resources import resources
 
 
-class Camera:
-    def __init__(self, cap_index: int = 0, cap_flip: bool = False):
+logger = logging.getLogger(__name__)
+
+# Slider settings and the driver properties behind them
+cap_setting_properties = {"cap_brightness": cv2.CAP_PROP_BRIGHTNESS,
+                          "cap_contrast": cv2.CAP_PROP_CONTRAST,
+                          "cap_hue": cv2.CAP_PROP_HUE,
+                          "cap_saturation": cv2.CAP_PROP_SATURATION,
+                          "cap_sharpness": cv2.CAP_PROP_SHARPNESS,
+                          "cap_gamma": cv2.CAP_PROP_GAMMA}
+
+
+class FrameSource:
+    def __init__(self, fps: float = 30.0, realtime: bool = True, loop: bool = True):
+        self.fps = fps
+        self.realtime = realtime
+        self.loop = loop
+
+        self.width = 0
+        self.height = 0
+        self.frame_index = 0
+        self.next_frame_time = None
+        self.opened = True
+        self.properties = {}
+
+        resources.acquire("capture")
+
+    def read_frame(self, image=None):
+        raise NotImplementedError
+
+    def reopened(self):
+        # A released source cannot read again, this builds a fresh one with the same settings
+        raise NotImplementedError
+
+    def rewind(self):
+        self.frame_index = 0
+
+    def pace(self):
+        if not self.realtime or self.fps <= 0:
+            return
+
+        frame_period = 1 / self.fps
+        now = time.perf_counter()
+
+        # Restart the schedule after a stall instead of bursting to catch up
+        if self.next_frame_time is None or now - self.next_frame_time > frame_period:
+            self.next_frame_time = now
+
+        delay = self.next_frame_time - now
+        if delay > 0:
+            time.sleep(delay)
+
+        self.next_frame_time += frame_period
+
+    def read(self, image=None):
+        if not self.opened:
+            return False, None
+
+        frame = self.read_frame(image)
+
+        if frame is None and self.loop and self.frame_index > 0:
+            self.rewind()
+            frame = self.read_frame(image)
+
+        if frame is None:
+            return False, None
+
+        self.frame_index += 1
+        self.pace()
+
+        return True, frame
+
+    def get(self, prop_id):
+        if prop_id == cv2.CAP_PROP_FRAME_WIDTH:
+            return float(self.width)
+
+        if prop_id == cv2.CAP_PROP_FRAME_HEIGHT:
+            return float(self.height)
+
+        if prop_id == cv2.CAP_PROP_FPS:
+            return float(self.fps)
+
+        if prop_id == cv2.CAP_PROP_POS_FRAMES:
+            return float(self.frame_index)
+
+        return self.properties.get(prop_id, 0.0)
+
+    def set(self, prop_id, value):
+        self.properties[prop_id] = value
+        return False
+
+    def isOpened(self):
+        return self.opened
+
+    def release(self):
+        if self.opened:
+            self.opened = False
+            resources.release("capture")
+
+
+class DeviceSource(FrameSource):
+    def __init__(self, cap_index: int = 0):
+        # A live device is paced by its sensor, there is nothing to replay
+        super().__init__(realtime=False, loop=False)
+
+        self.cap_index = cap_index
         self.cap = cv2.VideoCapture(cap_index)
+
+        self.width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS)
+
+    def reopened(self):
+        return DeviceSource(self.cap_index)
+
+    def read(self, image=None):
+        return self.cap.read(image)
+
+    def get(self, prop_id):
+        return self.cap.get(prop_id)
+
+    def set(self, prop_id, value):
+        return self.cap.set(prop_id, value)
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def release(self):
+        super().release()
+        self.cap.release()
+
+
+class VideoFileSource(FrameSource):
+    def __init__(self, video_path: str, realtime: bool = True, loop: bool = True):
+        super().__init__(realtime=realtime, loop=loop)
+
+        self.video_path = video_path
+        self.cap = cv2.VideoCapture(video_path)
+
+        if not self.cap.isOpened():
+            raise Exception(f"An error occured while opening the video {video_path}.")
+
+        self.width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 30.0
+        self.frame_count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+
+    def reopened(self):
+        return VideoFileSource(self.video_path, self.realtime, self.loop)
+
+    def read_frame(self, image=None):
+        success, frame = self.cap.read(image)
+        return frame if success else None
+
+    def rewind(self):
+        super().rewind()
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+
+    def release(self):
+        super().release()
+        self.cap.release()
+
+
+class ImageDirSource(FrameSource):
+    image_extensions = (".bmp", ".jpeg", ".jpg", ".png", ".tif", ".tiff", ".webp")
+
+    def __init__(self, image_dir: str, fps: float = 30.0, realtime: bool = True,
+                 loop: bool = True, preload: bool = False):
+        super().__init__(fps=fps, realtime=realtime, loop=loop)
+
+        self.image_dir = image_dir
+        self.image_paths = sorted(os.path.join(image_dir, file_name)
+                                  for file_name in os.listdir(image_dir)
+                                  if file_name.lower().endswith(self.image_extensions))
+
+        if not self.image_paths:
+            raise Exception(f"An error occured while opening the images in {image_dir}.")
+
+        # Preloading keeps disk and decoding out of benchmark timings
+        self.images = [cv2.imread(image_path)
+                       for image_path in self.image_paths] if preload else None
+
+        self.height, self.width = self.load_image(0).shape[:2]
+        self.frame_count = len(self.image_paths)
+
+    def reopened(self):
+        return ImageDirSource(self.image_dir, self.fps, self.realtime, self.loop,
+                              preload=self.images is not None)
+
+    def load_image(self, index):
+        if self.images is not None:
+            return self.images[index]
+
+        return cv2.imread(self.image_paths[index])
+
+    def read_frame(self, image=None):
+        if self.frame_index >= self.frame_count:
+            return None
+
+        frame = self.load_image(self.frame_index)
+
+        if image is not None and image.shape == frame.shape:
+            np.copyto(image, frame)
+            return image
+
+        return frame.copy() if self.images is not None else frame
+
+
+class SyntheticSource(FrameSource):
+    def __init__(self, width: int = 640, height: int = 480, fps: float = 30.0,
+                 realtime: bool = True, frame_count: int = 0, seed: int = 0):
+        super().__init__(fps=fps, realtime=realtime, loop=frame_count > 0)
+
+        self.width = width
+        self.height = height
+        self.frame_count = frame_count
+        self.seed = seed
+
+        rng = np.random.default_rng(seed)
+        self.background = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+        self.background = cv2.GaussianBlur(self.background, (0, 0), 15)
+        self.phase = rng.uniform(0, 2 * np.pi, 2)
+
+    def reopened(self):
+        return SyntheticSource(self.width, self.height, self.fps, self.realtime,
+                               self.frame_count, self.seed)
+
+    def read_frame(self, image=None):
+        if self.frame_count and self.frame_index >= self.frame_count:
+            return None
+
+        if image is None or image.shape != self.background.shape:
+            image = np.empty_like(self.background)
+
+        np.copyto(image, self.background)
+
+        # Frames depend on the index only, so every run sees the same pixels
+        t = self.frame_index / self.fps
+        center = (int(self.width * (0.5 + 0.3 * np.sin(t + self.phase[0]))),
+                  int(self.height * (0.5 + 0.3 * np.sin(1.3 * t + self.phase[1]))))
+        radius = max(min(self.width, self.height) // 8, 1)
+
+        cv2.circle(image, center, radius, (96, 128, 224), -1)
+
+        return image
+
+
+def open_source(source_spec, realtime: bool = True):
+    if isinstance(source_spec, FrameSource):
+        return source_spec
+
+    if isinstance(source_spec, int) or str(source_spec).isdigit():
+        return DeviceSource(int(source_spec))
+
+    if source_spec == "synthetic":
+        return SyntheticSource(realtime=realtime)
+
+    if os.path.isdir(source_spec):
+        return ImageDirSource(source_spec, realtime=realtime)
+
+    return VideoFileSource(source_spec, realtime=realtime)
+
+
+class SourceOpener:
+    def __init__(self, warmup_frames: int = 3, warmup_timeout: float = 3.0):
+        self.warmup_frames = warmup_frames
+        self.warmup_timeout = warmup_timeout
+
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.pending = None
+
+    def request(self, source_spec):
+        # The old source keeps streaming while the new one opens and warms up
+        with self.lock:
+            self.generation += 1
+            generation = self.generation
+
+        threading.Thread(target=self.open, args=(generation, source_spec),
+                         name="sailor-source-open", daemon=True).start()
+
+    def warm_up(self, source):
+        deadline = time.perf_counter() + self.warmup_timeout
+        frames_read = 0
+
+        # Devices often return nothing or black frames right after opening
+        while frames_read < self.warmup_frames and time.perf_counter() < deadline:
+            success, _ = source.read()
+
+            if success:
+                frames_read += 1
+            else:
+                time.sleep(0.01)
+
+        return frames_read > 0
+
+    def open(self, generation, source_spec):
+        try:
+            source = open_source(source_spec)
+        except Exception:
+            # The current source stays, as if the switch had not been asked for
+            logger.exception("An error occured while opening the source %s", source_spec)
+            return
+
+        if not self.warm_up(source):
+            # Some drivers only open one device at a time, the swap retries in place
+            source.release()
+            source = None
+
+        with self.lock:
+            if generation != self.generation:
+                stale = source
+            else:
+                stale = self.pending[1] if self.pending is not None else None
+                self.pending = (source_spec, source)
+
+        if stale is not None:
+            stale.release()
+
+    def take(self):
+        with self.lock:
+            pending, self.pending = self.pending, None
+
+        return pending
+
+    def cancel(self):
+        with self.lock:
+            self.generation += 1
+            pending, self.pending = self.pending, None
+
+        if pending is not None and pending[1] is not None:
+            pending[1].release()
+
+
+class FrameRing:
+    def __init__(self, ring_size: int = 3):
+        # The writer needs one slot besides the latest and the one being read
+        self.ring_size = max(ring_size, 3)
+        self.frames = []
+        self.lock = threading.Lock()
+        self.frame_ready = threading.Event()
+        self.new_frame = threading.Condition(self.lock)
+
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.write_index = 0
+            self.latest_index = None
+            self.reading_index = None
+            self.latest_timestamp = None
+            self.read_timestamp = None
+            self.latest_seq = 0
+            self.read_seq = 0
+            self.frames_captured = 0
+            self.frames_dropped = 0
+            self.frames_duplicated = 0
+            self.frame_ready.clear()
+
+    def allocate(self, shape, dtype):
+        self.frames = [np.empty(shape, dtype) for _ in range(self.ring_size)]
+        self.write_index = 0
+        self.latest_index = None
+        self.reading_index = None
+
+    def acquire(self):
+        with self.lock:
+            if not self.frames:
+                return None
+
+            for offset in range(self.ring_size):
+                index = (self.write_index + offset) % self.ring_size
+                if index != self.latest_index and index != self.reading_index:
+                    break
+
+            self.write_index = index
+
+            return self.frames[index]
+
+    def publish(self, frame, timestamp=None):
+        with self.lock:
+            if not self.frames or frame is not self.frames[self.write_index]:
+                # First frame or the capture changed resolution
+                self.allocate(frame.shape, frame.dtype)
+                np.copyto(self.frames[self.write_index], frame)
+
+            if self.latest_seq > self.read_seq:
+                self.frames_dropped += 1
+
+            self.latest_index = self.write_index
+            self.latest_timestamp = timestamp
+            self.latest_seq += 1
+            self.frames_captured += 1
+            self.write_index = (self.write_index + 1) % self.ring_size
+
+            self.new_frame.notify_all()
+
+        self.frame_ready.set()
+
+    def wait(self, timeout: float = None):
+        with self.lock:
+            return self.new_frame.wait_for(lambda: self.latest_seq > self.read_seq,
+                                           timeout)
+
+    def read(self, flip: bool = False):
+        with self.lock:
+            if self.latest_index is None:
+                return None
+
+            if self.latest_seq == self.read_seq:
+                self.frames_duplicated += 1
+
+            self.read_seq = self.latest_seq
+            self.read_timestamp = self.latest_timestamp
+            self.reading_index = self.latest_index
+            frame = self.frames[self.reading_index]
+
+        # The caller draws on the returned frame, so it gets its own copy
+        if flip:
+            frame = cv2.flip(frame, 1)
+        else:
+            frame = frame.copy()
+
+        with self.lock:
+            self.reading_index = None
+
+        return frame
+
+    def get_stats(self):
+        with self.lock:
+            return {"captured": self.frames_captured,
+                    "dropped": self.frames_dropped,
+                    "duplicated": self.frames_duplicated}
+
+
+class Camera:
+    def __init__(self, cap_index: int = 0, cap_flip: bool = False,
+                 cap_threaded: bool = True, ring_size: int = 3, source=None):
+        self.cap_source = cap_index if source is None else source
+        self.cap = open_source(self.cap_source)
         self.cap_flip = cap_flip
+        self.cap_properties = {}
+        self.cap_effective = {}
+        self.pending_properties = {}
+        self.properties_lock = threading.Lock()
+        self.source_opener = SourceOpener()
 
-        self.get_default_cap_settings()
+        self.read_default_cap_settings(self.cap)
 
         self.frame_width = self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)
         self.frame_height = self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
 
+        self.frame_ring = FrameRing(ring_size)
+        self.capture_thread = None
+        self.capture_stop = None
+        self.capture_release = None
+        self.first_frame_timeout = 1.0
+        self.frame_timestamp = None
+
+        self.cap_threaded = cap_threaded
+
+        if self.cap_threaded:
+            self.start_capture()
+
+    def read_default_cap_settings(self, cap):
+        # Read once per device, the page is answered from these without touching the driver
+        for name, prop_id in cap_setting_properties.items():
+            setattr(self, name, cap.get(prop_id))
+
+    def default_cap_properties(self):
+        return {prop_id: getattr(self, name) for name, prop_id in cap_setting_properties.items()}
+
     def get_default_cap_settings(self):
-        self.cap_brightness = self.cap.get(cv2.CAP_PROP_BRIGHTNESS)
-        self.cap_contrast = self.cap.get(cv2.CAP_PROP_CONTRAST)
-        self.cap_hue = self.cap.get(cv2.CAP_PROP_HUE)
-        self.cap_saturation = self.cap.get(cv2.CAP_PROP_SATURATION)
-        self.cap_sharpness = self.cap.get(cv2.CAP_PROP_SHARPNESS)
-        self.cap_gamma = self.cap.get(cv2.CAP_PROP_GAMMA)
         self.cap_flip = False
 
         return self.cap_brightness, self.cap_contrast, self.cap_hue, \
@@ -27,39 +488,210 @@ class Camera:
             self.cap_flip
 
     def set_default_cap_settings(self):
-        self.cap.set(cv2.CAP_PROP_BRIGHTNESS, self.cap_brightness)
-        self.cap.set(cv2.CAP_PROP_CONTRAST, self.cap_contrast)
-        self.cap.set(cv2.CAP_PROP_HUE, self.cap_hue)
-        self.cap.set(cv2.CAP_PROP_SATURATION, self.cap_saturation)
-        self.cap.set(cv2.CAP_PROP_SHARPNESS, self.cap_sharpness)
-        self.cap.set(cv2.CAP_PROP_GAMMA, self.cap_gamma)
+        for prop_id, value in self.default_cap_properties().items():
+            self.set_cap_property(prop_id, value)
 
     def set_cap_index(self, cap_index):
-        self.set_default_cap_settings()
-        self.cap = cv2.VideoCapture(cap_index)
+        self.source_opener.request(cap_index)
+
+    def retire_cap(self, cap, defaults):
+        # Nothing else reads this device any more, it is restored directly
+        for prop_id, value in defaults.items():
+            cap.set(prop_id, value)
+
+        cap.release()
+
+    def swap_cap(self, cap):
+        opened = self.source_opener.take()
+        if opened is None:
+            return cap
+
+        cap_source, new_cap = opened
+
+        defaults = self.default_cap_properties()
+
+        if new_cap is None:
+            # The new device could not open next to the old one, switch the slow way
+            self.retire_cap(cap, defaults)
+            new_cap = open_source(cap_source)
+        else:
+            threading.Thread(target=self.retire_cap, args=(cap, defaults),
+                             name="sailor-source-close", daemon=True).start()
+
+        with self.properties_lock:
+            self.pending_properties.clear()
+
+        self.cap, self.cap_source = new_cap, cap_source
+        self.cap_properties = {}
+        self.cap_effective = {}
+        self.read_default_cap_settings(new_cap)
+
+        self.frame_width = new_cap.get(cv2.CAP_PROP_FRAME_WIDTH)
+        self.frame_height = new_cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
+
+        return new_cap
 
     def set_cap_flip(self, flip_value):
         self.cap_flip = flip_value
 
     def set_cap_brightness(self, brightness_value):
-        self.cap.set(cv2.CAP_PROP_BRIGHTNESS, brightness_value)
+        self.set_cap_property(cv2.CAP_PROP_BRIGHTNESS, brightness_value)
 
     def set_cap_contrast(self, contrast_value):
-        self.cap.set(cv2.CAP_PROP_CONTRAST, contrast_value)
+        self.set_cap_property(cv2.CAP_PROP_CONTRAST, contrast_value)
 
     def set_cap_hue(self, hue_value):
-        self.cap.set(cv2.CAP_PROP_HUE, hue_value)
+        self.set_cap_property(cv2.CAP_PROP_HUE, hue_value)
 
     def set_cap_saturation(self, saturation_value):
-        self.cap.set(cv2.CAP_PROP_SATURATION, saturation_value)
+        self.set_cap_property(cv2.CAP_PROP_SATURATION, saturation_value)
 
     def set_cap_sharpness(self, sharpness_value):
-        self.cap.set(cv2.CAP_PROP_SHARPNESS, sharpness_value)
+        self.set_cap_property(cv2.CAP_PROP_SHARPNESS, sharpness_value)
 
     def set_cap_gamma(self, gamma_value):
-        self.cap.set(cv2.CAP_PROP_GAMMA, gamma_value)
+        self.set_cap_property(cv2.CAP_PROP_GAMMA, gamma_value)
+
+    def set_cap_property(self, prop_id, value):
+        # Remembered so a reopened device comes back as the user left it
+        self.cap_properties[prop_id] = value
+
+        # A slider drag queues many values, only the last one reaches the driver
+        with self.properties_lock:
+            self.pending_properties[prop_id] = value
+
+    def apply_cap_properties(self, cap):
+        with self.properties_lock:
+            if not self.pending_properties:
+                return
+
+            properties, self.pending_properties = self.pending_properties, {}
+
+        # Drivers may block here or clamp the value, the read back is what took effect
+        for prop_id, value in properties.items():
+            if cap.set(prop_id, value):
+                self.cap_effective[prop_id] = value, cap.get(prop_id)
+
+    def get_effective_cap_settings(self):
+        effective = {}
+
+        for name, prop_id in cap_setting_properties.items():
+            requested, applied = self.cap_effective.get(prop_id, (None, None))
+
+            # Only clamped values of the latest request, a newer one may still be queued
+            if requested is not None and requested == self.cap_properties.get(prop_id) \
+                    and applied != requested:
+                effective[name] = applied
+
+        return effective
+
+    def close(self):
+        self.source_opener.cancel()
+
+        if self.stop_capture():
+            self.cap.release()
+        else:
+            # Releasing during a read crashes some backends, the thread releases on exit
+            self.capture_release.set()
+
+            if not self.capture_thread.is_alive():
+                # It exited before seeing the flag, releasing twice is harmless
+                self.cap.release()
+
+    def reopen(self):
+        if isinstance(self.cap_source, FrameSource):
+            # close() released the instance that was handed in
+            self.cap_source = self.cap_source.reopened()
+
+        self.cap = open_source(self.cap_source)
+
+        with self.properties_lock:
+            self.pending_properties.update(self.cap_properties)
+
+        if self.cap_threaded:
+            self.start_capture()
+
+    def start_capture(self):
+        if self.capture_thread is not None:
+            # A thread that outlived stop_capture is still reading, never read concurrently
+            self.capture_thread.join()
+            self.capture_thread = None
+
+        self.frame_ring.reset()
+        self.capture_stop = threading.Event()
+        self.capture_release = threading.Event()
+        self.capture_thread = threading.Thread(target=self.capture_loop,
+                                               args=(self.cap, self.capture_stop,
+                                                     self.capture_release),
+                                               name="sailor-capture",
+                                               daemon=True)
+        self.capture_thread.start()
+
+    def stop_capture(self, timeout: float = 1.0):
+        if self.capture_thread is None:
+            return True
+
+        self.capture_stop.set()
+        self.capture_thread.join(timeout)
+
+        if self.capture_thread.is_alive():
+            # Kept so nothing touches the device until the blocked read returns
+            logger.warning("The capture thread did not stop within %.1fs", timeout)
+            return False
+
+        self.capture_thread = None
+        return True
+
+    def capture_loop(self, cap, stop, release):
+        while not stop.is_set():
+            try:
+                # Device changes happen between reads, the ring adapts to a new resolution
+                cap = self.swap_cap(cap)
+                self.apply_cap_properties(cap)
+
+                frame = self.frame_ring.acquire()
+                read_start = time.perf_counter()
+                success, frame = cap.read(frame)
+
+                if not success:
+                    # Avoid spinning on a closed or unplugged device
+                    stop.wait(0.01)
+                    continue
+
+                # The frame reached the host when read returned, latency counts from here
+                captured = time.perf_counter()
+                profiler.record("capture", read_start, captured)
+                self.frame_ring.publish(frame, captured)
+
+            except Exception:
+                logger.exception("An error occured while capturing a frame")
+                stop.wait(0.1)
+
+        if release.is_set():
+            cap.release()
+
+    def wait_frame(self, timeout: float = None):
+        if not self.cap_threaded:
+            return True
+
+        return self.frame_ring.wait(timeout)
+
+    def get_capture_stats(self):
+        return self.frame_ring.get_stats()
 
     def process(self):
+        if self.cap_threaded:
+            self.frame_ring.frame_ready.wait(self.first_frame_timeout)
+            frame = self.frame_ring.read(self.cap_flip)
+            self.frame_timestamp = self.frame_ring.read_timestamp
+
+            return frame
+
+        self.cap = self.swap_cap(self.cap)
+        self.apply_cap_properties(self.cap)
+
+        read_start = time.perf_counter()
+
         if self.cap_flip:
             _, frame = self.cap.read()
             frame = cv2.flip(frame, 1)
@@ -67,6 +699,9 @@ class Camera:
         else:
             _, frame = self.cap.read()
 
+        self.frame_timestamp = time.perf_counter()
+        profiler.record("capture", read_start, self.frame_timestamp)
+
         return frame
 
     def as_base64(self, frame):
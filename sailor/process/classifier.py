@@ -1,46 +1,156 @@
+import time
 import pickle
 from contextlib import contextmanager
 from sailor.utils.dirscan import find_path
+from sailor.process.forest import compile_model
+from sailor.process.bundle import load_bundle, read_labels
+from sailor.process.gestures import GestureGate
+from sailor.process.profiler import profiler
 from sailor.process.tracker import np, cv2, Tracker
 
 
 class Classifier(Tracker):
-    def __init__(self, model_file: str = "model.p", labels_file: str = "labels.txt"):
-        super().__init__()
+    def __init__(self, model_file: str = "model.smb", labels_file: str = "labels.txt", **tracker_kwargs):
+        super().__init__(**tracker_kwargs)
 
         self.model_file = model_file
-        self.model_dict = pickle.load(open(find_path(self.model_file), "rb"))
-        self.model = self.model_dict["model"]
+        self.gesture_gate = GestureGate()
 
-        self.labels_file = find_path(labels_file)
-        self.labels_dict = {}
+        if self.model_file.endswith(".p"):
+            # Legacy pickles run arbitrary code, only load trusted local files
+            self.model_dict = pickle.load(open(find_path(self.model_file), "rb"))
+            self.set_model(self.model_dict["model"])
 
-        with open(self.labels_file, "r") as labels:
-            for label in labels:
-                label = label.strip().split()
-                label_value = int(label[0])
-                label_name = label[1]
-                self.labels_dict[label_value] = label_name
+            self.labels_file = find_path(labels_file)
+            self.labels_dict = read_labels(self.labels_file)
+
+        else:
+            self.set_bundle(load_bundle(find_path(self.model_file)))
+
+        self.gesture_events = []
+        self.predicted_characters = []
+        self.prediction_proba = np.empty((0, len(self.model.classes_)))
+        self.frames_since_classify = 0
+
+        self.setup_default_gesture_settings()
+
+    def setup_default_gesture_settings(self):
+        self.gesture_window = 5
+        self.gesture_press_threshold = 0.6
+        self.gesture_release_threshold = 0.4
+        self.gesture_min_dwell = 0.1
+        self.gesture_hold_time = 0.5
+        self.classify_stable_stride = 2
+
+        self.gesture_gate.set_window(self.gesture_window)
+        self.gesture_gate.press_threshold = self.gesture_press_threshold
+        self.gesture_gate.release_threshold = self.gesture_release_threshold
+        self.gesture_gate.min_dwell = self.gesture_min_dwell
+        self.gesture_gate.hold_time = self.gesture_hold_time
+
+        return self.gesture_window, \
+            self.gesture_press_threshold, \
+            self.gesture_release_threshold, \
+            self.gesture_min_dwell, \
+            self.gesture_hold_time, \
+            self.classify_stable_stride
+
+    def set_gesture_window(self, window_value):
+        self.gesture_window = window_value
+        self.gesture_gate.set_window(window_value)
+
+    def set_gesture_press_threshold(self, threshold_value):
+        self.gesture_press_threshold = threshold_value
+        self.gesture_gate.press_threshold = threshold_value
+
+    def set_gesture_release_threshold(self, threshold_value):
+        self.gesture_release_threshold = threshold_value
+        self.gesture_gate.release_threshold = threshold_value
+
+    def set_gesture_min_dwell(self, dwell_value):
+        self.gesture_min_dwell = dwell_value
+        self.gesture_gate.min_dwell = dwell_value
+
+    def set_gesture_hold_time(self, hold_value):
+        self.gesture_hold_time = hold_value
+        self.gesture_gate.hold_time = hold_value
+
+    def set_classify_stable_stride(self, stride_value):
+        self.classify_stable_stride = stride_value
+
+    def gesture_name(self, class_index):
+        if class_index is None:
+            return None
+
+        return self.labels_dict[self.model.classes_[class_index].item()]
+
+    def set_model(self, model):
+        self.model = compile_model(model)
+        self.gesture_gate.reset()
+
+    def set_bundle(self, bundle, model_file: str = None):
+        self.model = bundle.model
+        self.labels_dict = bundle.labels_dict
+        self.gesture_gate.reset()
+
+        if model_file is not None:
+            self.model_file = model_file
 
     @contextmanager
     def predict_hands(self, frame):
         with self.track_hands(frame):
+            timestamp = time.perf_counter()
+
             if self.results.multi_hand_landmarks:
-                for self.hand_type, self.hand_landmark in zip(self.results.multi_handedness, self.results.multi_hand_landmarks):
-                    for self.hand_landmarks in self.results.multi_hand_landmarks:
-                        self.prediction = self.model.predict(
-                            [np.asarray(self.landmarks_data)])
-                        self.predicted_character = self.labels_dict[int(
-                            self.prediction[0])]
-
-                        if self.overlay_hands_gesture_label:
-                            cv2.putText(frame,
-                                        self.predicted_character,
-                                        (self.x_min + self.labeled_hand_offset,
-                                         self.y_min - self.labeled_hand_offset),
-                                        cv2.FONT_HERSHEY_PLAIN,
-                                        2,
-                                        self.hand_type_label_color,
-                                        2)
+                hand_labels = [hand_type.classification[0].label
+                               for hand_type in self.results.multi_handedness]
+                self.hand_keys = [label if hand_labels.count(label) == 1 else f"{label}{index}"
+                                  for index, label in enumerate(hand_labels)]
+
+                # A held gesture does not need a fresh vote on every frame,
+                # and extrapolated landmarks carry no new evidence
+                skip_classify = len(self.prediction_proba) == len(self.hand_keys) and \
+                    (not self.landmarks_tracked or
+                     self.gesture_gate.is_stable() and
+                     self.frames_since_classify + 1 < self.classify_stable_stride)
+
+                if skip_classify:
+                    self.frames_since_classify += 1
+
+                else:
+                    # One call for all hands, sklearn overhead is paid per call
+                    with profiler.span("classify"):
+                        self.prediction_proba = self.model.predict_proba(
+                            self.hand_features)
+                    self.frames_since_classify = 0
+
+                self.gesture_events = self.gesture_gate.update(self.hand_keys,
+                                                               self.prediction_proba,
+                                                               timestamp)
+
+                predicted_classes = self.prediction_proba.argmax(axis=1)
+
+                self.prediction = self.model.classes_[predicted_classes]
+                self.prediction_confidence = self.prediction_proba[
+                    np.arange(len(predicted_classes)), predicted_classes]
+                self.predicted_characters = [self.labels_dict[prediction]
+                                             for prediction in self.prediction.tolist()]
+
+            else:
+                self.hand_keys = []
+                self.predicted_characters = []
+                self.gesture_events = self.gesture_gate.update([], [], timestamp)
 
         yield frame
+
+    def draw_overlay(self, renderer):
+        super().draw_overlay(renderer)
+
+        if not self.overlay_hands_gesture_label:
+            return
+
+        for predicted_character, (x_min, y_min, _, _) in zip(self.predicted_characters, self.hand_regions):
+            renderer.add_text(predicted_character,
+                              (x_min + self.labeled_hand_offset,
+                               y_min - self.labeled_hand_offset),
+                              self.hand_type_label_color)
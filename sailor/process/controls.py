@@ -1,22 +1,60 @@
-import pyautogui as pag
-from sailor.process.classifier import np, cv2, Classifier
+import time
+from sailor.process.actuator import Actuator
+from sailor.process.filters import cursor_filters
+from sailor.process.classifier import np, Classifier
 
 
 class Controls(Classifier):
-    def __init__(self, activate: bool = False):
-        super().__init__()
+    def __init__(self, activate: bool = False, mouse_backend=None, **classifier_kwargs):
+        super().__init__(**classifier_kwargs)
 
         self.activate = activate
 
-        self.screen_width, self.screen_height = pag.size()
+        self.actuator = Actuator(mouse_backend)
+        self.actuator.start()
+
+        self.screen_width, self.screen_height = self.actuator.backend.size()
 
         self.frame_reduction = 150
+        self.cursor_point = None
+
+        self.setup_default_filter_settings()
+
+    def setup_default_filter_settings(self):
+        self.cursor_filter_type = "one_euro"
+        self.cursor_filter_min_cutoff = 1.0
+        self.cursor_filter_beta = 0.007
+        self.cursor_filter_alpha = 0.5
+        self.cursor_filter_process_noise = 500.0
+        self.cursor_filter_measurement_noise = 8.0
+
+        self.setup_cursor_filter()
+
+        return self.cursor_filter_type, \
+            self.cursor_filter_min_cutoff, \
+            self.cursor_filter_beta, \
+            self.cursor_filter_alpha, \
+            self.cursor_filter_process_noise, \
+            self.cursor_filter_measurement_noise
+
+    def setup_cursor_filter(self):
+        filter_kwargs = {
+            "one_euro": {"min_cutoff": self.cursor_filter_min_cutoff,
+                         "beta": self.cursor_filter_beta},
+            "kalman": {"process_noise": self.cursor_filter_process_noise,
+                       "measurement_noise": self.cursor_filter_measurement_noise},
+            "exponential": {"alpha": self.cursor_filter_alpha},
+        }
+
+        self.cursor_filter = cursor_filters[self.cursor_filter_type](
+            **filter_kwargs.get(self.cursor_filter_type, {}))
 
     def get_default_controls_settings(self):
         self.activate = False
         self.frame_reduction = 150
 
-        return self.activate, self.frame_reduction
+        return (self.activate, self.frame_reduction) + \
+            self.setup_default_filter_settings()
 
     def set_activate_control(self, activate_value):
         self.activate = activate_value
@@ -24,23 +62,56 @@ class Controls(Classifier):
     def set_frame_reduction(self, reduction_value):
         self.frame_reduction = reduction_value
 
+    def set_cursor_filter_type(self, filter_type_value):
+        self.cursor_filter_type = filter_type_value
+        self.setup_cursor_filter()
+
+    def set_cursor_filter_min_cutoff(self, min_cutoff_value):
+        self.cursor_filter_min_cutoff = min_cutoff_value
+        self.cursor_filter.min_cutoff = min_cutoff_value
+
+    def set_cursor_filter_beta(self, beta_value):
+        self.cursor_filter_beta = beta_value
+        self.cursor_filter.beta = beta_value
+
+    def set_cursor_filter_alpha(self, alpha_value):
+        self.cursor_filter_alpha = alpha_value
+        self.cursor_filter.alpha = alpha_value
+
+    def set_cursor_filter_process_noise(self, process_noise_value):
+        self.cursor_filter_process_noise = process_noise_value
+        self.cursor_filter.process_noise = process_noise_value
+
+    def set_cursor_filter_measurement_noise(self, measurement_noise_value):
+        self.cursor_filter_measurement_noise = measurement_noise_value
+        self.cursor_filter.measurement_noise = measurement_noise_value
+
+    def close(self):
+        self.actuator.stop()
+        super().close()
+
+    def reopen(self):
+        super().reopen()
+        self.setup_cursor_filter()
+        self.actuator.start()
+
     def hands_control(self, frame):
         with self.predict_hands(frame):
-            if self.results.multi_hand_landmarks:
+            self.cursor_point = None
 
-                new_mouse_position_x = 0
-                new_mouse_position_y = 0
+            if self.results.multi_hand_landmarks and self.activate:
+                cursor_moved = False
 
-                prev_mouse_position_x = 0
-                prev_mouse_position_y = 0
+                for self.hand_index, hand_key in enumerate(self.hand_keys):
+                    active_gesture = self.gesture_name(
+                        self.gesture_gate.active_label(hand_key))
 
-                if self.activate:
-                    if self.predicted_character == self.labels_dict[1]:
-                        index_finger_tip_landmark = self.hand_landmark.landmark[
-                            self.mp_hands.HandLandmark.INDEX_FINGER_TIP]
+                    # The first hand holding the move gesture drives the cursor
+                    if active_gesture == self.labels_dict[1] and not cursor_moved:
+                        cursor_moved = True
 
-                        index_finger_tip_x = index_finger_tip_landmark.x * self.w
-                        index_finger_tip_y = index_finger_tip_landmark.y * self.h
+                        index_finger_tip_x, index_finger_tip_y = self.hand_landmarks_array[
+                            self.hand_index, self.mp_hands.HandLandmark.INDEX_FINGER_TIP, :2] * (self.w, self.h)
 
                         interp_index_finger_tip_x = np.interp(
                             index_finger_tip_x, (self.frame_reduction, int(self.frame_width) - self.frame_reduction), (0, self.screen_width))
@@ -48,42 +119,35 @@ class Controls(Classifier):
                         interp_index_finger_tip_y = np.interp(
                             index_finger_tip_y, (self.frame_reduction, int(self.frame_height) - self.frame_reduction), (0, self.screen_height))
 
-                        new_mouse_position_x = prev_mouse_position_x + \
-                            (interp_index_finger_tip_x - prev_mouse_position_x)
-
-                        new_mouse_position_y = prev_mouse_position_y + \
-                            (interp_index_finger_tip_y - prev_mouse_position_y)
-
-                        if self.cap_flip:
-                            new_mouse_position_x = int(
-                                new_mouse_position_x)
+                        if not self.cap_flip:
+                            interp_index_finger_tip_x = self.screen_width - interp_index_finger_tip_x
 
-                        else:
-                            new_mouse_position_x = int(self.screen_width -
-                                                       new_mouse_position_x)
+                        new_mouse_position_x, new_mouse_position_y = self.cursor_filter.filter(
+                            (interp_index_finger_tip_x, interp_index_finger_tip_y), time.perf_counter())
 
-                        new_mouse_position_y = int(new_mouse_position_y)
+                        self.actuator.move_to(int(new_mouse_position_x),
+                                              int(new_mouse_position_y),
+                                              self.frame_timestamp)
 
-                        pag.moveTo(new_mouse_position_x,
-                                   new_mouse_position_y, tween=1, _pause=False)
+                        self.cursor_point = int(index_finger_tip_x), int(index_finger_tip_y)
 
-                        prev_mouse_position_x = np.mean(
-                            new_mouse_position_x)
+            if self.activate:
+                # Click once per press, not on every frame the gesture is held
+                for event in self.gesture_events:
+                    if event.kind == "press" and self.gesture_name(event.label) == self.labels_dict[3]:
+                        self.actuator.click()
 
-                        prev_mouse_position_y = np.mean(
-                            new_mouse_position_y)
-
-                        cv2.circle(frame, (int(index_finger_tip_x), int(
-                            index_finger_tip_y)), radius=5, color=(255, 0, 255), thickness=2)
+        return frame
 
-                        cv2.rectangle(frame,
-                                      (self.frame_reduction, self.frame_reduction),
-                                      (self.w - self.frame_reduction,
-                                       self.h - self.frame_reduction),
-                                      (255, 0, 255),
-                                      2)
+    def draw_overlay(self, renderer):
+        super().draw_overlay(renderer)
 
-                    if self.predicted_character == self.labels_dict[3]:
-                        pag.click(duration=0.1, _pause=False)
+        if self.cursor_point is None:
+            return
 
-        return frame
+        renderer.add_circle(self.cursor_point, 5, (255, 0, 255), 2)
+        renderer.add_rectangle((self.frame_reduction, self.frame_reduction),
+                               (self.w - self.frame_reduction,
+                                self.h - self.frame_reduction),
+                               (255, 0, 255),
+                               2)
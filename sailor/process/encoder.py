@@ -0,0 +1,110 @@
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from sailor.process.profiler import profiler
+from sailor.process.resources import resources
+
+try:
+    from turbojpeg import TurboJPEG
+except ImportError:
+    # PyTurboJPEG is optional, OpenCV's encoder is the fallback
+    TurboJPEG = None
+
+
+content_types = {"jpeg": "image/jpeg", "webp": "image/webp"}
+
+
+class PreviewEncoder:
+    def __init__(self, quality: int = 80, image_format: str = "jpeg", workers: int = 2):
+        if image_format not in content_types:
+            raise ValueError(f"Unsupported preview format {image_format}.")
+
+        self.quality = quality
+        self.image_format = image_format
+        self.content_type = content_types[image_format]
+        self.workers = workers
+
+        self.turbojpeg = None
+        if image_format == "jpeg" and TurboJPEG is not None:
+            try:
+                self.turbojpeg = TurboJPEG()
+            except (OSError, RuntimeError):
+                # The wrapper is installed but libturbojpeg is missing
+                self.turbojpeg = None
+
+        self.lock = threading.Lock()
+        self.pool = None
+        self.buffers = []
+        self.buffer_shape = None
+        self.submitted_seq = 0
+        self.published_seq = 0
+        self.frames_skipped = 0
+
+    def set_quality(self, quality_value):
+        self.quality = quality_value
+
+    def encode(self, image):
+        # Imported here so building an encoder does not load OpenCV
+        import cv2
+
+        if self.turbojpeg is not None:
+            return self.turbojpeg.encode(image, quality=int(self.quality))
+
+        if self.image_format == "webp":
+            _, data = cv2.imencode(".webp", image, (cv2.IMWRITE_WEBP_QUALITY, int(self.quality)))
+        else:
+            _, data = cv2.imencode(".jpg", image, (cv2.IMWRITE_JPEG_QUALITY, int(self.quality)))
+
+        return data.tobytes()
+
+    def acquire(self, shape):
+        with self.lock:
+            if shape != self.buffer_shape:
+                # Buffers still out with the old size are dropped when released
+                self.buffer_shape = shape
+                self.buffers = [np.empty(shape, np.uint8) for _ in range(self.workers + 1)]
+
+            if not self.buffers:
+                # Every buffer is still being encoded, this preview frame is skipped
+                self.frames_skipped += 1
+                return None
+
+            return self.buffers.pop()
+
+    def release(self, buffer):
+        with self.lock:
+            if buffer.shape == self.buffer_shape:
+                self.buffers.append(buffer)
+
+    def submit(self, image, callback):
+        if self.pool is None:
+            self.pool = ThreadPoolExecutor(self.workers, thread_name_prefix="sailor-encoder")
+            resources.acquire("encoder_pool")
+
+        with self.lock:
+            self.submitted_seq += 1
+            seq = self.submitted_seq
+
+        return self.pool.submit(self.encode_job, seq, image, callback)
+
+    def encode_job(self, seq, image, callback):
+        try:
+            # OpenCV releases the GIL here, so encoding overlaps the next frame
+            with profiler.span("encode"):
+                data = self.encode(image)
+        finally:
+            self.release(image)
+
+        with self.lock:
+            # A slower worker must not replace a newer preview with an older one
+            if seq < self.published_seq:
+                return
+
+            self.published_seq = seq
+            callback(data)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+            self.pool = None
+            resources.release("encoder_pool")
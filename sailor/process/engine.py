@@ -0,0 +1,449 @@
+import time
+import queue
+import asyncio
+import logging
+import threading
+from sailor.process.encoder import PreviewEncoder
+from sailor.process.profiler import profiler
+from sailor.process.resources import resources
+
+
+logger = logging.getLogger(__name__)
+
+
+class SettingsProxy:
+    def __init__(self, engine):
+        object.__setattr__(self, "engine", engine)
+
+    def __getattr__(self, name):
+        value = getattr(self.engine.controls, name)
+
+        if not callable(value):
+            return value
+
+        # Setters are applied by the worker between frames, anything that
+        # returns values is awaited while an executor waits for the pipeline to pause
+        if name.startswith("set_"):
+            return lambda *args: self.engine.submit(value, *args)
+
+        return lambda *args: self.engine.call_async(value, *args)
+
+    def __setattr__(self, name, value):
+        self.engine.submit(setattr, self.engine.controls, name, value)
+
+
+class Engine:
+    def __init__(self, pipeline_stages: int = 0, preview_quality: int = 80,
+                 preview_width: int = None, preview_format: str = "jpeg",
+                 encoder_workers: int = 2, idle_timeout: float = 0, **controls_kwargs):
+        self.controls_kwargs = controls_kwargs
+        self.controls = None
+        self.settings = SettingsProxy(self)
+
+        self.pipeline_stages = pipeline_stages
+        self.pipeline = None
+        self.frames_dropped = 0
+
+        self.lock = threading.Lock()
+        self.commands = queue.SimpleQueue()
+        self.sinks = []
+        self.preview_sinks = []
+        self.preview_width = preview_width
+        self.encoder = PreviewEncoder(preview_quality, preview_format, encoder_workers)
+
+        self.ready = threading.Event()
+        self.start_finished = threading.Event()
+        self.error = None
+        self.stopped = threading.Event()
+        self.worker = None
+        self.frame_timeout = 0.5
+
+        self.users = 0
+        self.idle_timeout = idle_timeout
+        self.idle_timer = None
+        self.lifecycle_lock = threading.RLock()
+
+    def start(self):
+        with self.lifecycle_lock:
+            worker = self.worker
+            if worker is not None:
+                if worker.is_alive() and not self.stopped.is_set():
+                    return
+
+                # A worker still tearing down after stop() holds the camera until it exits
+                worker.join()
+                self.worker = None
+
+            self.stopped.clear()
+            self.start_finished.clear()
+            self.error = None
+            self.worker = threading.Thread(target=self.run,
+                                           name="sailor-engine",
+                                           daemon=True)
+            self.worker.start()
+
+    def stop(self):
+        with self.lifecycle_lock:
+            if self.idle_timer is not None:
+                self.idle_timer.cancel()
+                self.idle_timer = None
+
+            worker = self.worker
+            if worker is None:
+                return
+
+            self.stopped.set()
+            worker.join(timeout=2)
+
+            if worker.is_alive():
+                # Kept so start() waits for it instead of opening the camera twice
+                logger.warning("The engine did not stop within 2s")
+                return
+
+            self.worker = None
+
+    def acquire(self):
+        with self.lifecycle_lock:
+            self.users += 1
+
+            if self.idle_timer is not None:
+                self.idle_timer.cancel()
+                self.idle_timer = None
+
+            self.start()
+
+    def release(self):
+        with self.lifecycle_lock:
+            self.users -= 1
+
+            if self.users > 0 or self.idle_timeout <= 0:
+                return
+
+            # A page reload reconnects within the grace period and keeps the camera open
+            self.idle_timer = threading.Timer(self.idle_timeout, self.stop_idle)
+            self.idle_timer.daemon = True
+            self.idle_timer.start()
+
+    def stop_idle(self):
+        with self.lifecycle_lock:
+            if self.users == 0:
+                self.stop()
+
+    async def acquire_async(self):
+        await asyncio.get_running_loop().run_in_executor(None, self.acquire)
+
+    async def wait_ready(self, timeout: float = None):
+        deadline = None if timeout is None else time.perf_counter() + timeout
+
+        # Polled on the loop, an executor thread blocked here would hold up shutdown
+        while not self.start_finished.is_set():
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+
+            await asyncio.sleep(0.05)
+
+        if self.error is not None:
+            raise Exception(f"An error occured while starting the engine. {self.error}")
+
+        if not self.ready.is_set():
+            within = f" within {timeout:g}s" if timeout is not None else ""
+            raise Exception(f"The engine did not start{within}")
+
+    def frame_stats(self):
+        controls = self.controls
+        # The ring counts under its own lock, reading it never waits for a frame
+        stats = controls.get_capture_stats() if controls is not None else {}
+        stats["submit_dropped"] = self.frames_dropped
+        stats["preview_skipped"] = self.encoder.frames_skipped
+
+        return stats
+
+    def metrics_text(self):
+        lines = ["# TYPE sailor_frames_total counter"]
+
+        for outcome, count in self.frame_stats().items():
+            lines.append(f'sailor_frames_total{{outcome="{outcome}"}} {count}')
+
+        if self.controls is not None:
+            lines.append("# TYPE sailor_actuator_commands_dropped_total counter")
+            lines.append(f"sailor_actuator_commands_dropped_total "
+                         f"{self.controls.actuator.commands_dropped}")
+
+        return "\n".join(lines) + "\n"
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+
+    def remove_sink(self, sink):
+        if sink in self.sinks:
+            self.sinks.remove(sink)
+
+    def add_preview_sink(self, sink, is_active=None):
+        self.preview_sinks.append((sink, is_active))
+
+    def preview_sinks_active(self):
+        return any(is_active is None or is_active() for _, is_active in self.preview_sinks)
+
+    def preview_scale(self, frame):
+        if not self.preview_width:
+            return 1.0
+
+        return min(1.0, self.preview_width / frame.shape[1])
+
+    def render_preview(self, frame):
+        scale = self.preview_scale(frame)
+        height, width = frame.shape[:2]
+
+        buffer = self.encoder.acquire((round(height * scale), round(width * scale), 3))
+        if buffer is None:
+            return None
+
+        return self.controls.render_overlay(frame, scale, buffer)
+
+    def render_preview_in_place(self, frame):
+        # The encode stage reads the shared slot, a scaled preview goes into its top left corner
+        if self.preview_scale(frame) == 1.0:
+            self.controls.render_overlay(frame)
+            return frame.shape[:2]
+
+        preview = self.render_preview(frame)
+        height, width = preview.shape[:2]
+
+        frame[:height, :width] = preview
+        self.encoder.release(preview)
+
+        return height, width
+
+    def encode_preview(self, preview, captured):
+        def publish_encoded(data):
+            self.publish_preview(data)
+            self.record_latency(captured)
+
+        self.encoder.submit(preview, publish_encoded)
+
+    def publish(self, frame):
+        for sink in list(self.sinks):
+            sink(frame)
+
+    def publish_preview(self, data):
+        for sink, is_active in list(self.preview_sinks):
+            if is_active is None or is_active():
+                sink(data)
+
+    def get_stage_stats(self):
+        return profiler.summary()
+
+    def submit(self, func, *args):
+        self.commands.put((func, args))
+
+    def call(self, func, *args):
+        with self.lock:
+            self.apply_commands()
+            return func(*args)
+
+    async def call_async(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, self.call, func, *args)
+
+    def apply_commands(self):
+        while True:
+            try:
+                func, args = self.commands.get_nowait()
+            except queue.Empty:
+                return
+
+            try:
+                func(*args)
+            except Exception:
+                logger.exception("An error occured while applying %s", func)
+
+    def step(self):
+        if self.pipeline is not None:
+            return self.step_pipelined()
+
+        if not self.controls.wait_frame(self.frame_timeout):
+            # Settings still apply without frames, a dead camera can be switched away from
+            with self.lock:
+                self.apply_commands()
+
+            return None
+
+        frame_start = time.perf_counter()
+
+        with self.lock:
+            self.apply_commands()
+
+            frame = self.controls.process()
+            if frame is None:
+                return None
+
+            with profiler.span("controls"):
+                frame = self.controls.hands_control(frame)
+
+            # Nobody watching means no overlay and no encoding
+            preview = self.render_preview(frame) if self.preview_sinks_active() else None
+            captured = self.controls.frame_timestamp
+
+        self.publish(frame)
+
+        if preview is not None:
+            self.encode_preview(preview, captured)
+
+        profiler.record("frame", frame_start)
+
+        return frame
+
+    def record_latency(self, captured):
+        if captured is not None:
+            profiler.record("glass_to_preview", captured)
+
+    def step_pipelined(self):
+        # Keep collecting results while the tracker works on earlier frames
+        frame_timeout = 0.005 if self.pipeline.in_flight() else self.frame_timeout
+
+        if not self.controls.wait_frame(frame_timeout):
+            with self.lock:
+                self.apply_commands()
+
+            self.handle_results(self.pipeline.poll())
+            return None
+
+        with self.lock:
+            self.apply_commands()
+
+            frame = self.controls.process()
+            captured = self.controls.frame_timestamp
+            # Debounced by the controls, a slider drag rebuilds the worker graph once
+            hands_settings = self.controls.worker_hands_settings
+
+        if frame is not None:
+            if frame.shape != self.pipeline.shape:
+                self.pipeline.start(frame.shape, hands_settings)
+
+            self.pipeline.configure_hands(hands_settings)
+
+            with profiler.span("submit"):
+                if self.pipeline.submit(frame, captured) is None:
+                    self.frames_dropped += 1
+
+        self.handle_results(self.pipeline.poll())
+
+        return frame
+
+    def handle_results(self, messages):
+        for stage, slot, payload, queued, started, finished in messages:
+            profiler.record(f"{stage}_queue", queued, started)
+            profiler.record(stage, started, finished)
+
+            if stage == "track":
+                from sailor.process.pipeline import tracked_results
+
+                frame = self.pipeline.frame(slot)
+
+                with self.lock, profiler.span("controls"):
+                    self.controls.external_results = tracked_results(*payload)
+                    self.controls.frame_timestamp = self.pipeline.captured[slot]
+                    self.controls.hands_control(frame)
+
+                # The frame lives in a shared slot, sinks copy what they keep
+                self.publish(frame)
+
+                if self.preview_sinks_active():
+                    if self.pipeline.has_stage("encode"):
+                        with self.lock:
+                            preview_shape = self.render_preview_in_place(frame)
+
+                        self.pipeline.encode(slot, self.encoder.quality, preview_shape)
+                        continue
+
+                    with self.lock:
+                        preview = self.render_preview(frame)
+
+                    if preview is not None:
+                        self.encode_preview(preview, self.pipeline.captured[slot])
+
+            else:
+                self.publish_preview(payload)
+                self.record_latency(self.pipeline.captured[slot])
+
+            profiler.record("frame", self.pipeline.submitted[slot])
+            self.pipeline.release(slot)
+
+    def idle(self, seconds):
+        if self.pipeline is None:
+            self.stopped.wait(seconds)
+            return
+
+        deadline = time.perf_counter() + seconds
+
+        while not self.stopped.is_set():
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+
+            self.handle_results(self.pipeline.poll(remaining))
+
+    def run(self):
+        run_start = time.perf_counter()
+
+        # Imported here so the web server can answer before the vision stack loads
+        from sailor.process.controls import Controls
+        from sailor.process.pipeline import Pipeline
+
+        resources.acquire("engine")
+
+        try:
+            # Settings survive an idle stop, only the devices and workers are reopened
+            if self.controls is None:
+                # Pipeline workers track, an in-process graph would never be used
+                self.controls = Controls(local_hands=not self.pipeline_stages,
+                                         **self.controls_kwargs)
+            else:
+                self.controls.reopen()
+
+            if self.pipeline_stages:
+                self.pipeline = Pipeline(self.pipeline_stages,
+                                         image_format=self.encoder.image_format)
+
+        except Exception as e:
+            logger.exception("An error occured while starting the engine")
+            self.error = e
+            self.close()
+
+            # The next acquire() retries from scratch
+            self.worker = None
+            self.start_finished.set()
+            return
+
+        profiler.record("engine_start", run_start)
+        self.ready.set()
+        self.start_finished.set()
+
+        while not self.stopped.is_set():
+            try:
+                # Every captured frame is processed, the camera paces the loop and the
+                # inference scheduler decides which frames the tracker skips
+                if self.step() is None:
+                    self.idle(0.01)
+            except Exception:
+                logger.exception("An error occured while processing a frame")
+                self.stopped.wait(0.1)
+
+        self.close()
+
+    def close(self):
+        self.ready.clear()
+
+        if self.pipeline is not None:
+            self.pipeline.stop()
+            self.pipeline = None
+
+        self.encoder.close()
+
+        if self.controls is not None:
+            try:
+                self.controls.close()
+            except Exception:
+                # A failed reopen leaves some devices closed already
+                logger.exception("An error occured while closing the controls")
+
+        resources.release("engine")
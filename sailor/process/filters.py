@@ -0,0 +1,113 @@
+import numpy as np
+
+
+class PointFilter:
+    def __init__(self, reset_after: float = 0.5):
+        self.reset_after = reset_after
+        self.reset()
+
+    def reset(self):
+        self.point = None
+        self.timestamp = None
+
+    def update(self, point, dt):
+        return point
+
+    def filter(self, point, timestamp):
+        point = np.asarray(point, np.float64)
+
+        # Start over when the hand comes back after a pause
+        if self.point is None or timestamp - self.timestamp > self.reset_after:
+            self.reset()
+            self.point = point
+            self.timestamp = timestamp
+            self.start(point)
+            return point
+
+        dt = max(timestamp - self.timestamp, 1e-6)
+        self.timestamp = timestamp
+        self.point = self.update(point, dt)
+
+        return self.point
+
+    def start(self, point):
+        pass
+
+
+class ExponentialFilter(PointFilter):
+    def __init__(self, alpha: float = 0.5, **kwargs):
+        self.alpha = alpha
+        super().__init__(**kwargs)
+
+    def update(self, point, dt):
+        return self.point + self.alpha * (point - self.point)
+
+
+class OneEuroFilter(PointFilter):
+    def __init__(self, min_cutoff: float = 1.0, beta: float = 0.007, d_cutoff: float = 1.0, **kwargs):
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        super().__init__(**kwargs)
+
+    @staticmethod
+    def smoothing_factor(cutoff, dt):
+        tau = 1 / (2 * np.pi * cutoff)
+        return 1 / (1 + tau / dt)
+
+    def start(self, point):
+        self.speed = np.zeros_like(point)
+
+    def update(self, point, dt):
+        speed = (point - self.point) / dt
+        self.speed += self.smoothing_factor(self.d_cutoff, dt) * (speed - self.speed)
+
+        # Fast movements raise the cutoff to cut lag, slow ones lower it to cut jitter
+        cutoff = self.min_cutoff + self.beta * np.abs(self.speed)
+
+        return self.point + self.smoothing_factor(cutoff, dt) * (point - self.point)
+
+
+class KalmanFilter(PointFilter):
+    def __init__(self, process_noise: float = 500.0, measurement_noise: float = 8.0, **kwargs):
+        # Acceleration and measurement standard deviations in pixels
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+        super().__init__(**kwargs)
+
+    def start(self, point):
+        self.velocity = np.zeros_like(point)
+        self.p00 = np.full_like(point, self.measurement_noise ** 2)
+        self.p01 = np.zeros_like(point)
+        self.p11 = np.full_like(point, self.process_noise ** 2)
+
+    def update(self, point, dt):
+        q = self.process_noise ** 2
+        r = self.measurement_noise ** 2
+
+        # Predict with a constant velocity model, each axis independently
+        position = self.point + self.velocity * dt
+        self.p00 += dt * (2 * self.p01 + dt * self.p11) + q * dt ** 3 / 3
+        self.p01 += dt * self.p11 + q * dt ** 2 / 2
+        self.p11 += q * dt
+
+        innovation = point - position
+        gain_position = self.p00 / (self.p00 + r)
+        gain_velocity = self.p01 / (self.p00 + r)
+
+        position += gain_position * innovation
+        self.velocity += gain_velocity * innovation
+
+        self.p11 -= gain_velocity * self.p01
+        self.p00 *= 1 - gain_position
+        self.p01 *= 1 - gain_position
+
+        return position
+
+
+cursor_filters = {
+    "one_euro": OneEuroFilter,
+    "kalman": KalmanFilter,
+    "exponential": ExponentialFilter,
+    "none": PointFilter,
+}
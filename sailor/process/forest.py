@@ -0,0 +1,97 @@
+import numpy as np
+
+
+class CompiledForest:
+    def __init__(self, feature, threshold, children, leaf_values, roots, max_depth, classes, n_features):
+        self.feature = feature
+        self.threshold = threshold
+        self.children = children
+        self.children_flat = children.ravel()
+        self.leaf_values = leaf_values
+        self.roots = roots
+        self.max_depth = max_depth
+
+        self.classes_ = classes
+        self.n_features_in_ = n_features
+        self.n_estimators = len(roots)
+
+    @classmethod
+    def from_sklearn(cls, model):
+        features = []
+        thresholds = []
+        children = []
+        leaf_values = []
+        roots = []
+        max_depth = 0
+        offset = 0
+
+        for estimator in model.estimators_:
+            tree = estimator.tree_
+            nodes = np.arange(tree.node_count)
+            is_leaf = tree.children_left < 0
+
+            # Leaves point at themselves so a fixed number of steps lands every sample on one
+            left = np.where(is_leaf, nodes, tree.children_left) + offset
+            right = np.where(is_leaf, nodes, tree.children_right) + offset
+
+            values = tree.value[:, 0, :]
+            values = values / values.sum(axis=1, keepdims=True)
+
+            features.append(np.where(is_leaf, 0, tree.feature))
+            thresholds.append(np.where(is_leaf, np.inf, tree.threshold))
+            children.append(np.stack((left, right), axis=1))
+            leaf_values.append(values)
+            roots.append(offset)
+
+            max_depth = max(max_depth, tree.max_depth)
+            offset += tree.node_count
+
+        return cls(np.ascontiguousarray(np.concatenate(features), np.intp),
+                   np.ascontiguousarray(np.concatenate(thresholds), np.float64),
+                   np.ascontiguousarray(np.concatenate(children), np.intp),
+                   np.ascontiguousarray(np.concatenate(leaf_values), np.float64),
+                   np.asarray(roots, np.intp),
+                   max_depth,
+                   np.asarray(model.classes_),
+                   int(model.n_features_in_))
+
+    def apply(self, X):
+        # sklearn compares float32 features against float64 thresholds
+        X = np.ascontiguousarray(X, np.float32)
+        if X.ndim == 1:
+            X = X[None, :]
+
+        samples = X.shape[0]
+        X_flat = X.ravel()
+        row_offsets = (np.arange(samples, dtype=np.intp) * X.shape[1])[:, None]
+
+        nodes = np.repeat(self.roots[None, :], samples, axis=0)
+
+        for depth in range(self.max_depth):
+            values = X_flat.take(self.feature.take(nodes) + row_offsets)
+            next_nodes = self.children_flat.take(
+                2 * nodes + (values > self.threshold.take(nodes)))
+
+            # Most paths are far shorter than the deepest tree
+            if depth % 4 == 3 and np.array_equal(next_nodes, nodes):
+                break
+
+            nodes = next_nodes
+
+        return nodes
+
+    def predict_proba(self, X):
+        leaves = self.apply(X)
+
+        return self.leaf_values[leaves].sum(axis=1) / self.n_estimators
+
+    def predict(self, X):
+        return self.classes_[self.predict_proba(X).argmax(axis=1)]
+
+
+def compile_model(model):
+    # Anything that is not a tree ensemble keeps running through its own predict
+    if hasattr(model, "estimators_") and all(hasattr(estimator, "tree_") for estimator in model.estimators_):
+        return CompiledForest.from_sklearn(model)
+
+    return model
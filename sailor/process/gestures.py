@@ -0,0 +1,102 @@
+import numpy as np
+from collections import deque, namedtuple
+
+
+GestureEvent = namedtuple("GestureEvent", ["kind", "hand", "label", "confidence"])
+
+
+class HandGestureState:
+    def __init__(self, window: int):
+        self.probas = deque(maxlen=window)
+        self.candidate = None
+        self.candidate_since = 0.0
+        self.active = None
+        self.active_since = 0.0
+        self.held = False
+        self.last_seen = 0.0
+
+
+class GestureGate:
+    def __init__(self, window: int = 5, press_threshold: float = 0.6, release_threshold: float = 0.4,
+                 min_dwell: float = 0.1, hold_time: float = 0.5, lost_after: float = 0.3):
+        self.window = window
+        self.press_threshold = press_threshold
+        self.release_threshold = release_threshold
+        self.min_dwell = min_dwell
+        self.hold_time = hold_time
+        self.lost_after = lost_after
+
+        self.hands = {}
+
+    def reset(self):
+        self.hands = {}
+
+    def set_window(self, window_value):
+        self.window = window_value
+
+        for state in self.hands.values():
+            state.probas = deque(state.probas, maxlen=window_value)
+
+    def active_label(self, hand):
+        state = self.hands.get(hand)
+        return None if state is None else state.active
+
+    def is_stable(self):
+        # Every hand is holding a gesture with a full window of votes
+        return bool(self.hands) and all(state.held and len(state.probas) == self.window
+                                        for state in self.hands.values())
+
+    def update_hand(self, hand, proba, timestamp):
+        state = self.hands.get(hand)
+        if state is None:
+            state = self.hands[hand] = HandGestureState(self.window)
+
+        state.probas.append(proba)
+        state.last_seen = timestamp
+
+        mean_proba = np.mean(state.probas, axis=0)
+        events = []
+
+        if state.active is not None:
+            # Releasing needs a lower confidence than pressing, so borderline frames do not flicker
+            if mean_proba[state.active] < self.release_threshold:
+                events.append(GestureEvent("release", hand, state.active, float(mean_proba[state.active])))
+                state.active = None
+                state.held = False
+
+            elif not state.held and timestamp - state.active_since >= self.hold_time:
+                events.append(GestureEvent("hold", hand, state.active, float(mean_proba[state.active])))
+                state.held = True
+
+        if state.active is None:
+            best = int(mean_proba.argmax())
+            confidence = float(mean_proba[best])
+
+            if confidence < self.press_threshold:
+                state.candidate = None
+
+            elif state.candidate != best:
+                state.candidate = best
+                state.candidate_since = timestamp
+
+            if state.candidate is not None and timestamp - state.candidate_since >= self.min_dwell:
+                events.append(GestureEvent("press", hand, best, confidence))
+                state.active = best
+                state.active_since = timestamp
+                state.candidate = None
+
+        return events
+
+    def update(self, hands, probas, timestamp):
+        events = []
+
+        for hand, proba in zip(hands, probas):
+            events.extend(self.update_hand(hand, proba, timestamp))
+
+        for hand, state in list(self.hands.items()):
+            if timestamp - state.last_seen > self.lost_after:
+                if state.active is not None:
+                    events.append(GestureEvent("release", hand, state.active, 0.0))
+                del self.hands[hand]
+
+        return events
@@ -0,0 +1,79 @@
+import cv2
+import numpy as np
+from collections import defaultdict
+
+
+class OverlayRenderer:
+    def __init__(self, connections):
+        # Landmark index pairs are fixed, so the segment gather is built once
+        self.connections = np.array(sorted(connections), np.intp)
+
+        self.reset()
+
+    def reset(self):
+        self.lines = defaultdict(list)
+        self.points = defaultdict(list)
+        self.rectangles = []
+        self.circles = []
+        self.texts = []
+
+    def add_hands(self, landmarks_px, line_color, line_thickness,
+                  point_color, point_radius, point_thickness):
+        if not len(landmarks_px):
+            return
+
+        self.lines[(line_color, line_thickness)].append(
+            landmarks_px[:, self.connections].reshape(-1, 2, 2))
+
+        # A zero length segment with round caps is a filled dot
+        self.points[(point_color, 2 * point_radius + point_thickness)].append(
+            np.repeat(landmarks_px.reshape(-1, 1, 2), 2, axis=1))
+
+    def add_rectangle(self, top_left, bottom_right, color, thickness):
+        self.rectangles.append((top_left, bottom_right, color, thickness))
+
+    def add_circle(self, center, radius, color, thickness):
+        self.circles.append((center, radius, color, thickness))
+
+    def add_text(self, text, origin, color, font_scale=2, thickness=2):
+        self.texts.append((text, origin, color, font_scale, thickness))
+
+    def render(self, frame, scale: float = 1.0, out=None):
+        if out is not None:
+            # Reused preview buffer, the camera frame stays untouched
+            if scale != 1.0:
+                cv2.resize(frame, out.shape[1::-1], dst=out, interpolation=cv2.INTER_LINEAR)
+            else:
+                np.copyto(out, frame)
+
+            frame = out
+
+        elif scale != 1.0:
+            frame = cv2.resize(frame, None, fx=scale, fy=scale,
+                               interpolation=cv2.INTER_LINEAR)
+
+        def scaled(value):
+            return max(1, round(value * scale))
+
+        def scaled_point(point):
+            return round(point[0] * scale), round(point[1] * scale)
+
+        for styles in (self.lines, self.points):
+            for (color, thickness), segments in styles.items():
+                segments = np.rint(np.concatenate(segments) * scale).astype(np.int32)
+                cv2.polylines(frame, segments, False, color, scaled(thickness), cv2.LINE_AA)
+
+        for top_left, bottom_right, color, thickness in self.rectangles:
+            cv2.rectangle(frame, scaled_point(top_left), scaled_point(bottom_right),
+                          color, scaled(thickness))
+
+        for center, radius, color, thickness in self.circles:
+            cv2.circle(frame, scaled_point(center), scaled(radius), color, scaled(thickness))
+
+        for text, origin, color, font_scale, thickness in self.texts:
+            cv2.putText(frame, text, scaled_point(origin), cv2.FONT_HERSHEY_PLAIN,
+                        font_scale * scale, color, scaled(thickness))
+
+        self.reset()
+
+        return frame
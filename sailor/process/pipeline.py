@@ -0,0 +1,294 @@
+import time
+import queue
+import argparse
+import multiprocessing as mp_process
+from collections import namedtuple
+from multiprocessing import shared_memory
+from sailor.process.profiler import profiler
+from sailor.process.resources import resources
+from sailor.process.encoder import PreviewEncoder
+from sailor.process.tracker import np, cv2, mp, landmarks_array
+
+
+pipeline_stages = ("track", "encode")
+
+TrackedResults = namedtuple("TrackedResults", ("multi_hand_landmarks", "multi_handedness"))
+
+
+class SharedFrames:
+    def __init__(self, shm, slots, shape, owner):
+        self.shm = shm
+        self.slots = slots
+        self.shape = tuple(shape)
+        self.owner = owner
+
+        self.frames = np.ndarray((slots,) + self.shape, np.uint8, shm.buf)
+
+    @classmethod
+    def create(cls, slots, shape):
+        shm = shared_memory.SharedMemory(create=True,
+                                         size=slots * int(np.prod(shape)))
+        resources.acquire("shared_frames")
+
+        return cls(shm, slots, shape, owner=True)
+
+    @classmethod
+    def attach(cls, name, slots, shape):
+        # Spawned workers share the resource tracker of the engine process,
+        # which unlinks the block once in close()
+        return cls(shared_memory.SharedMemory(name=name), slots, shape, owner=False)
+
+    @property
+    def spec(self):
+        return self.shm.name, self.slots, self.shape
+
+    def __getitem__(self, slot):
+        return self.frames[slot]
+
+    def close(self):
+        # Views into the buffer must be gone before the mapping can close
+        self.frames = None
+        self.shm.close()
+
+        if self.owner:
+            self.shm.unlink()
+            resources.release("shared_frames")
+
+
+def track_stage(frames_spec, hands_kwargs, inbox, outbox):
+    frames = SharedFrames.attach(*frames_spec)
+    hands = mp.solutions.hands.Hands(**hands_kwargs)
+
+    try:
+        while True:
+            message = inbox.get()
+            if message is None:
+                break
+
+            kind, payload = message
+
+            if kind == "settings":
+                hands.close()
+                hands = mp.solutions.hands.Hands(**payload)
+                continue
+
+            slot, submitted = payload
+            started = time.perf_counter()
+
+            results = hands.process(cv2.cvtColor(frames[slot], cv2.COLOR_BGR2RGB))
+            handedness = [(hand_type.classification[0].index,
+                           hand_type.classification[0].score,
+                           hand_type.classification[0].label)
+                          for hand_type in results.multi_handedness or []]
+
+            outbox.put(("track", slot, (landmarks_array(results), handedness),
+                        submitted, started, time.perf_counter()))
+
+    finally:
+        hands.close()
+        frames.close()
+
+
+def encode_stage(frames_spec, image_format, inbox, outbox):
+    frames = SharedFrames.attach(*frames_spec)
+    encoder = PreviewEncoder(image_format=image_format)
+
+    try:
+        while True:
+            message = inbox.get()
+            if message is None:
+                break
+
+            slot, submitted, quality, height, width = message
+            started = time.perf_counter()
+
+            encoder.set_quality(quality)
+
+            outbox.put(("encode", slot, encoder.encode(frames[slot][:height, :width]),
+                        submitted, started, time.perf_counter()))
+
+    finally:
+        frames.close()
+
+
+def tracked_results(landmarks, handedness):
+    from mediapipe.framework.formats import classification_pb2, landmark_pb2
+
+    if not len(landmarks):
+        return TrackedResults(None, None)
+
+    hand_landmarks = [landmark_pb2.NormalizedLandmarkList(
+        landmark=[landmark_pb2.NormalizedLandmark(x=x, y=y, z=z) for x, y, z in points])
+        for points in landmarks.tolist()]
+    hand_types = [classification_pb2.ClassificationList(
+        classification=[classification_pb2.Classification(index=index, score=score, label=label)])
+        for index, score, label in handedness]
+
+    return TrackedResults(hand_landmarks, hand_types)
+
+
+class Pipeline:
+    def __init__(self, stages: int = 1, slots: int = 4, image_format: str = "jpeg"):
+        self.stages = pipeline_stages[:max(1, min(stages, len(pipeline_stages)))]
+        self.slots = slots
+        self.image_format = image_format
+
+        self.context = mp_process.get_context("spawn")
+        self.frames = None
+        self.workers = {}
+        self.inboxes = {}
+        self.outbox = None
+        self.free_slots = []
+        self.submitted = {}
+        self.captured = {}
+        self.hands_kwargs = None
+
+    @property
+    def shape(self):
+        return self.frames.shape if self.frames is not None else None
+
+    def start(self, shape, hands_kwargs):
+        self.stop()
+
+        self.frames = SharedFrames.create(self.slots, shape)
+        self.free_slots = list(range(self.slots))
+        self.hands_kwargs = dict(hands_kwargs)
+        self.outbox = self.context.Queue()
+
+        stage_args = {"track": (self.hands_kwargs,), "encode": (self.image_format,)}
+        stage_targets = {"track": track_stage, "encode": encode_stage}
+
+        for stage in self.stages:
+            self.inboxes[stage] = self.context.Queue()
+            self.workers[stage] = self.context.Process(
+                target=stage_targets[stage],
+                args=(self.frames.spec,) + stage_args[stage] +
+                (self.inboxes[stage], self.outbox),
+                name=f"sailor-{stage}",
+                daemon=True)
+            self.workers[stage].start()
+            resources.acquire("pipeline_worker")
+
+    def stop(self):
+        for stage in self.workers:
+            self.inboxes[stage].put(None)
+
+        deadline = time.perf_counter() + 2
+
+        for stage, worker in self.workers.items():
+            # A worker only exits once its queued results are read
+            while worker.is_alive() and time.perf_counter() < deadline:
+                self.poll(0.05)
+
+            if worker.is_alive():
+                worker.terminate()
+
+            resources.release("pipeline_worker")
+
+        self.workers.clear()
+        self.inboxes.clear()
+
+        if self.frames is not None:
+            self.frames.close()
+            self.frames = None
+
+    def has_stage(self, stage):
+        return stage in self.workers
+
+    def configure_hands(self, hands_kwargs):
+        hands_kwargs = dict(hands_kwargs)
+
+        if hands_kwargs != self.hands_kwargs:
+            self.hands_kwargs = hands_kwargs
+            self.inboxes["track"].put(("settings", hands_kwargs))
+
+    def submit(self, frame, captured=None):
+        if not self.free_slots:
+            return None
+
+        slot = self.free_slots.pop(0)
+        np.copyto(self.frames[slot], frame)
+
+        self.captured[slot] = captured
+
+        self.submitted[slot] = time.perf_counter()
+        self.inboxes["track"].put(("frame", (slot, self.submitted[slot])))
+
+        return slot
+
+    def encode(self, slot, quality, shape):
+        self.inboxes["encode"].put((slot, time.perf_counter(), quality) + tuple(shape))
+
+    def release(self, slot):
+        self.free_slots.append(slot)
+
+    def frame(self, slot):
+        return self.frames[slot]
+
+    def in_flight(self):
+        if self.frames is None:
+            return 0
+
+        return self.slots - len(self.free_slots)
+
+    def poll(self, timeout: float = 0.0):
+        messages = []
+
+        if self.outbox is None:
+            return messages
+
+        try:
+            messages.append(self.outbox.get(timeout=timeout) if timeout
+                            else self.outbox.get_nowait())
+
+            while True:
+                messages.append(self.outbox.get_nowait())
+        except queue.Empty:
+            pass
+
+        return messages
+
+
+def main():
+    from sailor.process.engine import Engine
+    from sailor.process.actuator import NullBackend
+
+    parser = argparse.ArgumentParser(description="Measure per-stage latency of the frame pipeline.")
+    parser.add_argument("--stages", type=int, default=1,
+                        help="worker processes, 0 runs every stage in the engine thread")
+    parser.add_argument("--source", default="synthetic")
+    parser.add_argument("--seconds", type=float, default=10)
+    args = parser.parse_args()
+
+    engine = Engine(pipeline_stages=args.stages,
+                    source=args.source,
+                    mouse_backend=NullBackend())
+    engine.add_preview_sink(lambda data: None)
+    engine.start()
+    engine.ready.wait()
+
+    # Worker start-up is not part of the steady state, wait until every stage has answered
+    warmup_stages = engine.pipeline.stages if engine.pipeline is not None else ("frame",)
+
+    while not all(stage in profiler.rings for stage in warmup_stages):
+        time.sleep(0.1)
+
+    # Frames queued during start-up finish before one submitted afterwards does
+    warmed = time.perf_counter()
+
+    while "frame" not in profiler.rings or profiler.ring("frame").snapshot()[0].max() < warmed:
+        time.sleep(0.1)
+
+    profiler.reset()
+    time.sleep(args.seconds)
+
+    for stage, stats in engine.get_stage_stats().items():
+        print(f"{stage:>16}: " + ", ".join(f"{key} {value:.2f}" for key, value in stats.items()))
+
+    print(f"{'fps':>16}: {profiler.ring('frame').count / args.seconds:.1f}")
+
+    engine.stop()
+
+
+if __name__ == "__main__":
+    main()
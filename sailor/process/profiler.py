@@ -0,0 +1,142 @@
+import os
+import json
+import time
+import asyncio
+import threading
+import itertools
+import numpy as np
+from contextlib import contextmanager
+
+
+class SpanRing:
+    def __init__(self, capacity: int = 2048):
+        self.capacity = capacity
+        self.starts = np.zeros(capacity)
+        self.ends = np.zeros(capacity)
+        self.count = 0
+        self.next_index = itertools.count()
+        self.thread_name = threading.current_thread().name
+
+    def record(self, start, end):
+        # Claiming an index is atomic, so pool threads can share a stage, and
+        # the slot is filled before count publishes it
+        index = next(self.next_index)
+        self.starts[index % self.capacity] = start
+        self.ends[index % self.capacity] = end
+        self.count = max(self.count, index + 1)
+
+    def snapshot(self):
+        count = self.count
+        size = min(count, self.capacity)
+        starts, ends = self.starts.copy(), self.ends.copy()
+
+        if count > self.capacity:
+            # Oldest span first, the slot being overwritten may be torn
+            order = np.roll(np.arange(self.capacity), -(count % self.capacity))[1:]
+            return starts[order], ends[order]
+
+        return starts[:size], ends[:size]
+
+
+class Profiler:
+    def __init__(self, capacity: int = 2048, enabled: bool = True):
+        self.capacity = capacity
+        self.enabled = enabled
+        self.rings = {}
+        self.lock = threading.Lock()
+
+    def ring(self, stage):
+        ring = self.rings.get(stage)
+
+        if ring is None:
+            with self.lock:
+                ring = self.rings.setdefault(stage, SpanRing(self.capacity))
+
+        return ring
+
+    def record(self, stage, start, end=None):
+        if self.enabled:
+            self.ring(stage).record(start, time.perf_counter() if end is None else end)
+
+    @contextmanager
+    def span(self, stage):
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.record(stage, start)
+
+    async def monitor_event_loop(self, interval: float = 0.1):
+        # Anything blocking the loop delays this wake-up, the overshoot is the lag
+        while True:
+            expected = time.perf_counter() + interval
+            await asyncio.sleep(interval)
+            self.record("event_loop_lag", expected)
+
+    def reset(self):
+        with self.lock:
+            self.rings = {}
+
+    def summary(self):
+        stages = {}
+
+        for stage, ring in list(self.rings.items()):
+            starts, ends = ring.snapshot()
+            if not len(starts):
+                continue
+
+            durations = (ends - starts) * 1000
+            p50, p95, p99 = np.percentile(durations, (50, 95, 99)).tolist()
+            stages[stage] = {"count": ring.count,
+                             "p50_ms": p50,
+                             "p95_ms": p95,
+                             "p99_ms": p99,
+                             "max_ms": float(durations.max())}
+
+        return stages
+
+    def metrics_text(self):
+        lines = ["# TYPE sailor_stage_seconds summary"]
+
+        for stage, stats in self.summary().items():
+            for quantile, key in (("0.5", "p50_ms"), ("0.95", "p95_ms"), ("0.99", "p99_ms")):
+                lines.append(f'sailor_stage_seconds{{stage="{stage}",quantile="{quantile}"}} '
+                             f'{stats[key] / 1000:.6f}')
+
+            lines.append(f'sailor_stage_seconds_count{{stage="{stage}"}} {stats["count"]}')
+
+        return "\n".join(lines) + "\n"
+
+    def chrome_trace(self):
+        events = []
+        pid = os.getpid()
+        thread_ids = {}
+
+        for stage, ring in list(self.rings.items()):
+            tid = thread_ids.setdefault(ring.thread_name, len(thread_ids) + 1)
+            starts, ends = ring.snapshot()
+
+            events.extend({"name": stage,
+                           "ph": "X",
+                           "ts": start * 1e6,
+                           "dur": (end - start) * 1e6,
+                           "pid": pid,
+                           "tid": tid}
+                          for start, end in zip(starts.tolist(), ends.tolist()))
+
+        events.extend({"name": "thread_name",
+                       "ph": "M",
+                       "pid": pid,
+                       "tid": tid,
+                       "args": {"name": thread_name}}
+                      for thread_name, tid in thread_ids.items())
+
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def dump_chrome_trace(self, path):
+        with open(path, "w") as trace_file:
+            json.dump(self.chrome_trace(), trace_file)
+
+
+profiler = Profiler()
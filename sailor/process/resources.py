@@ -0,0 +1,53 @@
+import logging
+import threading
+from collections import Counter
+
+
+logger = logging.getLogger(__name__)
+
+
+class Resources:
+    def __init__(self):
+        self.opened = Counter()
+        self.closed = Counter()
+        self.lock = threading.Lock()
+
+    def acquire(self, kind):
+        with self.lock:
+            self.opened[kind] += 1
+
+    def release(self, kind):
+        with self.lock:
+            self.closed[kind] += 1
+
+    def open_counts(self):
+        with self.lock:
+            return {kind: self.opened[kind] - self.closed[kind] for kind in self.opened}
+
+    def summary(self):
+        with self.lock:
+            return {kind: {"open": self.opened[kind] - self.closed[kind],
+                           "opened": self.opened[kind]}
+                    for kind in self.opened}
+
+    def metrics_text(self):
+        lines = ["# TYPE sailor_resources_open gauge",
+                 "# TYPE sailor_resources_opened_total counter"]
+
+        for kind, stats in self.summary().items():
+            lines.append(f'sailor_resources_open{{kind="{kind}"}} {stats["open"]}')
+            lines.append(f'sailor_resources_opened_total{{kind="{kind}"}} {stats["opened"]}')
+
+        return "\n".join(lines) + "\n"
+
+    def report_leaks(self):
+        # Meant for shutdown, after every owner had the chance to close
+        leaks = {kind: count for kind, count in self.open_counts().items() if count}
+
+        for kind, count in leaks.items():
+            logger.warning("%d %s resource(s) still open", count, kind)
+
+        return leaks
+
+
+resources = Resources()
@@ -0,0 +1,77 @@
+import math
+import numpy as np
+
+
+class InferenceScheduler:
+    def __init__(self,
+                 target_fps: float = 30,
+                 cpu_budget: float = 0.5,
+                 max_stride: int = 4,
+                 motion_threshold: float = 0.5,
+                 max_extrapolation: float = 0.15):
+        self.target_fps = target_fps
+        self.cpu_budget = cpu_budget
+        self.max_stride = max_stride
+        self.motion_threshold = motion_threshold
+        self.max_extrapolation = max_extrapolation
+
+        self.reset()
+
+    def reset(self):
+        self.landmarks = None
+        self.velocity = None
+        self.timestamp = None
+        self.speed = math.inf
+        self.inference_cost = 0.0
+        self.frames_since_inference = 0
+
+    def stride(self):
+        # Run the tracker often enough to keep up with the hand and rarely
+        # enough to stay inside the CPU budget at the target frame rate
+        budget_stride = math.ceil(self.inference_cost * self.target_fps /
+                                  max(self.cpu_budget, 0.01))
+
+        if self.landmarks is None or not len(self.landmarks):
+            motion_stride = self.max_stride
+        elif self.speed > self.motion_threshold:
+            motion_stride = 1
+        else:
+            # Slower hands allow longer gaps, up to max_stride when still
+            steadiness = 1 - self.speed / max(self.motion_threshold, 1e-6)
+            motion_stride = 1 + round(steadiness * (self.max_stride - 1))
+
+        return int(min(max(budget_stride, motion_stride, 1), self.max_stride))
+
+    def should_infer(self, timestamp):
+        if self.timestamp is None:
+            return True
+
+        if timestamp - self.timestamp > self.max_extrapolation:
+            return True
+
+        return self.frames_since_inference + 1 >= self.stride()
+
+    def observe(self, landmarks, timestamp, inference_cost):
+        self.inference_cost = inference_cost if self.inference_cost == 0 else \
+            0.8 * self.inference_cost + 0.2 * inference_cost
+
+        same_hands = self.landmarks is not None and \
+            self.landmarks.shape == landmarks.shape and len(landmarks)
+
+        if same_hands and timestamp > self.timestamp:
+            # Landmarks are normalized, speed is in frame widths per second
+            self.velocity = (landmarks - self.landmarks) / \
+                (timestamp - self.timestamp)
+            self.speed = float(np.abs(self.velocity[:, :, :2]).max())
+        else:
+            self.velocity = np.zeros_like(landmarks)
+            self.speed = math.inf if len(landmarks) else 0.0
+
+        self.landmarks = landmarks.copy()
+        self.timestamp = timestamp
+        self.frames_since_inference = 0
+
+    def extrapolate(self, timestamp):
+        self.frames_since_inference += 1
+
+        return self.landmarks + self.velocity * (timestamp - self.timestamp)
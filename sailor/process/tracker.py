@@ -1,35 +1,294 @@
 import re
+import time
+import threading
 import mediapipe as mp
 from contextlib import contextmanager
 from sailor.process.camera import np, cv2, Camera
+from sailor.process.overlay import OverlayRenderer
+from sailor.process.profiler import profiler
+from sailor.process.resources import resources
+from sailor.process.scheduler import InferenceScheduler
+
+
+num_landmarks = 21
+
+# Narrower crops come from hands leaving the frame, they are searched full frame instead
+min_roi_side = 32
+
+
+def landmarks_array(results, out=None):
+    hands = results.multi_hand_landmarks or []
+
+    if out is None or len(out) < len(hands):
+        out = np.empty((len(hands), num_landmarks, 3), np.float32)
+
+    landmarks = out[:len(hands)]
+
+    for hand_index, hand_landmarks in enumerate(hands):
+        landmarks[hand_index] = [(landmark.x, landmark.y, landmark.z)
+                                 for landmark in hand_landmarks.landmark]
+
+    return landmarks
+
+
+def extract_features(results):
+    return landmark_features(landmarks_array(results))
+
+
+def landmark_features(landmarks):
+    # Landmarks relative to the top left corner of each hand, x and y interleaved
+    xy = landmarks[:, :, :2]
+    features = xy - xy.min(axis=1, keepdims=True)
+
+    return features.reshape(len(landmarks), num_landmarks * 2)
+
+
+def hand_regions(landmarks, width, height):
+    if not len(landmarks):
+        return np.empty((0, 4), int)
+
+    xy = landmarks[:, :, :2] * np.array((width, height), np.float32)
+
+    return np.concatenate((xy.min(axis=1), xy.max(axis=1)), axis=1).astype(int)
+
+
+def roi_box(landmarks, width, height, padding):
+    # Extrapolated landmarks may lie outside the frame, the crop never does
+    xy = np.clip(landmarks[:, :, :2].reshape(-1, 2), 0, 1) * np.array((width, height), np.float32)
+    (x_min, y_min), (x_max, y_max) = xy.min(axis=0), xy.max(axis=0)
+
+    # Pad by a fraction of the larger side so fast motion stays inside the crop
+    pad = max(max(x_max - x_min, y_max - y_min) * padding, 16)
+
+    x0, y0 = max(int(x_min - pad), 0), max(int(y_min - pad), 0)
+    x1, y1 = min(int(x_max + pad) + 1, width), min(int(y_max + pad) + 1, height)
+
+    if x1 - x0 < min_roi_side or y1 - y0 < min_roi_side:
+        return None
+
+    return x0, y0, x1, y1
+
+
+def map_roi_landmarks(results, box, width, height):
+    x0, y0, x1, y1 = box
+    x_scale, y_scale = (x1 - x0) / width, (y1 - y0) / height
+    x_offset, y_offset = x0 / width, y0 / height
+
+    for hand_landmarks in results.multi_hand_landmarks or []:
+        for landmark in hand_landmarks.landmark:
+            landmark.x = x_offset + landmark.x * x_scale
+            landmark.y = y_offset + landmark.y * y_scale
+            landmark.z = landmark.z * x_scale
+
+
+def close_hands_graph(hands):
+    hands.close()
+    resources.release("hands")
+
+
+def close_in_background(hands):
+    threading.Thread(target=close_hands_graph, args=(hands,),
+                     name="sailor-hands-close", daemon=True).start()
+
+
+class HandsReconfigurer:
+    def __init__(self, build_hands, debounce: float = 0.3, close_hands=close_in_background):
+        self.build_hands = build_hands
+        self.debounce = debounce
+        self.close_hands = close_hands
+
+        self.lock = threading.Lock()
+        self.timer = None
+        self.generation = 0
+        self.pending_hands = None
+
+    def request(self):
+        # Every request restarts the countdown, so a slider drag builds once
+        with self.lock:
+            self.generation += 1
+
+            if self.timer is not None:
+                self.timer.cancel()
+
+            self.timer = threading.Timer(self.debounce, self.build)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def build(self):
+        with self.lock:
+            generation = self.generation
+
+        hands = self.build_hands()
+
+        with self.lock:
+            if generation != self.generation:
+                # Settings changed while building, the newer request builds again
+                stale_hands = hands
+            else:
+                stale_hands, self.pending_hands = self.pending_hands, hands
+
+        if stale_hands is not None and self.close_hands is not None:
+            self.close_hands(stale_hands)
+
+    def take(self):
+        with self.lock:
+            hands, self.pending_hands = self.pending_hands, None
+
+        return hands
+
+    def cancel(self):
+        with self.lock:
+            self.generation += 1
+
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+
+            hands, self.pending_hands = self.pending_hands, None
+
+        if hands is not None and self.close_hands is not None:
+            self.close_hands(hands)
 
 
 class Tracker(Camera):
-    def __init__(self):
-        super().__init__()
+    def __init__(self, local_hands: bool = True, **camera_kwargs):
+        self.local_hands = local_hands
+
+        super().__init__(**camera_kwargs)
 
         self.setup_default_model_settings()
         self.setup_hands()
+        self.setup_default_scheduler_settings()
+        self.setup_default_roi_settings()
         self.setup_default_display_settings()
         self.setup_default_landmark_values()
         self.setup_default_landmark_offset()
         self.setup_default_landmark_colors()
 
-    def setup_default_model_settings(self, detec_con=0.7, track_con=0.7, model_complexity=0):
+        self.landmarks_buffer = np.empty((2, num_landmarks, 3), np.float32)
+        self.hand_landmarks_array = self.landmarks_buffer[:0]
+        self.hand_regions = np.empty((0, 4), int)
+        self.hand_labels = []
+        self.external_results = None
+
+    def setup_default_model_settings(self, detec_con=0.7, track_con=0.7, model_complexity=0, max_num_hands=1):
         self.detec_con = detec_con
         self.track_con = track_con
         self.model_complexity = model_complexity
+        self.max_num_hands = max_num_hands
 
-        return self.detec_con, self.track_con, self.model_complexity
+        return self.detec_con, self.track_con, self.model_complexity, self.max_num_hands
 
     def setup_hands(self):
-        self.mp_drawing_utils = mp.solutions.drawing_utils
         self.mp_hands = mp.solutions.hands
-        self.model_hands = self.mp_hands.Hands(False,
-                                               1,
-                                               self.model_complexity,
-                                               self.detec_con,
-                                               self.track_con)
+
+        if self.local_hands:
+            self.model_hands = self.build_hands()
+            self.hands_reconfigurer = HandsReconfigurer(self.build_hands)
+        else:
+            # A pipeline worker owns the graph, only its settings go through the debounce
+            self.model_hands = None
+            self.worker_hands_settings = self.hands_settings()
+            self.hands_reconfigurer = HandsReconfigurer(self.hands_settings, close_hands=None)
+        self.overlay_renderer = OverlayRenderer(self.mp_hands.HAND_CONNECTIONS)
+
+    def hands_settings(self):
+        return {"static_image_mode": False,
+                "max_num_hands": self.max_num_hands,
+                "model_complexity": self.model_complexity,
+                "min_detection_confidence": self.detec_con,
+                "min_tracking_confidence": self.track_con}
+
+    def build_hands(self):
+        hands = self.mp_hands.Hands(**self.hands_settings())
+        resources.acquire("hands")
+        return hands
+
+    def swap_hands(self):
+        hands = self.hands_reconfigurer.take()
+
+        if hands is None:
+            return
+
+        if self.local_hands:
+            old_hands, self.model_hands = self.model_hands, hands
+            close_in_background(old_hands)
+        else:
+            self.worker_hands_settings = hands
+
+    def close_hands(self):
+        self.hands_reconfigurer.cancel()
+
+        # A reopen that failed before building the graph leaves nothing to close
+        if self.model_hands is not None:
+            close_hands_graph(self.model_hands)
+            self.model_hands = None
+
+    def close(self):
+        self.close_hands()
+        super().close()
+
+    def reopen(self):
+        super().reopen()
+
+        if self.local_hands:
+            self.model_hands = self.build_hands()
+        self.inference_scheduler.reset()
+
+    def setup_default_scheduler_settings(self):
+        self.adaptive_inference = True
+        self.target_fps = 30
+        self.cpu_budget = 0.5
+        self.max_inference_stride = 4
+        self.motion_threshold = 0.5
+
+        self.inference_scheduler = InferenceScheduler(self.target_fps,
+                                                      self.cpu_budget,
+                                                      self.max_inference_stride,
+                                                      self.motion_threshold)
+        self.landmarks_tracked = True
+
+        return self.adaptive_inference, \
+            self.target_fps, \
+            self.cpu_budget, \
+            self.max_inference_stride, \
+            self.motion_threshold
+
+    def set_adaptive_inference(self, adaptive_value):
+        self.adaptive_inference = adaptive_value
+        self.inference_scheduler.reset()
+
+    def set_target_fps(self, fps_value):
+        self.target_fps = fps_value
+        self.inference_scheduler.target_fps = fps_value
+
+    def set_cpu_budget(self, budget_value):
+        self.cpu_budget = budget_value
+        self.inference_scheduler.cpu_budget = budget_value
+
+    def set_max_inference_stride(self, stride_value):
+        self.max_inference_stride = stride_value
+        self.inference_scheduler.max_stride = stride_value
+
+    def set_motion_threshold(self, threshold_value):
+        self.motion_threshold = threshold_value
+        self.inference_scheduler.motion_threshold = threshold_value
+
+    def setup_default_roi_settings(self):
+        self.roi_inference = False
+        self.roi_padding = 0.5
+        self.roi_size = 256
+
+        return self.roi_inference, self.roi_padding, self.roi_size
+
+    def set_roi_inference(self, roi_value):
+        self.roi_inference = roi_value
+
+    def set_roi_padding(self, padding_value):
+        self.roi_padding = padding_value
+
+    def set_roi_size(self, size_value):
+        self.roi_size = size_value
 
     def setup_default_display_settings(self):
         self.overlay_hands_landmarks = True
@@ -77,20 +336,20 @@ class Tracker(Camera):
         self.region_landmark_color = (174, 204, 0)
 
     def set_model_max_cur_listhands(self, max_cur_listhands_value):
-        self.max_cur_listhands = max_cur_listhands_value
-        self.setup_hands()
+        self.max_num_hands = max_cur_listhands_value
+        self.hands_reconfigurer.request()
 
     def set_model_complexity(self, model_complexity_cur_listvalue):
         self.model_complexity = model_complexity_cur_listvalue
-        self.setup_hands()
+        self.hands_reconfigurer.request()
 
     def set_model_detec_con(self, detec_con_value):
         self.detec_con = detec_con_value
-        self.setup_hands()
+        self.hands_reconfigurer.request()
 
     def set_model_track_con(self, track_con_value):
         self.track_con = track_con_value
-        self.setup_hands()
+        self.hands_reconfigurer.request()
 
     def set_point_landmark_radius(self, radius_value):
         self.point_landmark_radius = radius_value
@@ -128,26 +387,74 @@ class Tracker(Camera):
     #     b = int(re.findall("[0-9]+", region_color_rgb)[2])
     #     self.region_landmark_color = b, g, r
 
+    def results_landmarks(self):
+        hands_count = len(self.results.multi_hand_landmarks or [])
+        if len(self.landmarks_buffer) < hands_count:
+            self.landmarks_buffer = np.empty(
+                (hands_count, num_landmarks, 3), np.float32)
+
+        return landmarks_array(self.results, self.landmarks_buffer)
+
+    def detect_hands(self, frame):
+        if self.external_results is not None:
+            # Tracked by a pipeline worker, see sailor.process.pipeline
+            results, self.external_results = self.external_results, None
+
+            return results
+
+        frame_height, frame_width = frame.shape[:2]
+        locked_hands = len(self.hand_landmarks_array)
+
+        box = None
+        if self.roi_inference and locked_hands and locked_hands >= self.max_num_hands:
+            box = roi_box(self.hand_landmarks_array,
+                          frame_width,
+                          frame_height,
+                          self.roi_padding)
+
+        if box is not None:
+            x0, y0, x1, y1 = box
+            roi = frame[y0:y1, x0:x1]
+
+            scale = self.roi_size / max(roi.shape[:2])
+            if scale < 1:
+                roi = cv2.resize(roi, None, fx=scale, fy=scale,
+                                 interpolation=cv2.INTER_LINEAR)
+
+            with profiler.span("track"):
+                results = self.model_hands.process(
+                    cv2.cvtColor(roi, cv2.COLOR_BGR2RGB))
+
+            if len(results.multi_hand_landmarks or []) >= locked_hands:
+                map_roi_landmarks(results, box, frame_width, frame_height)
+
+                return results
+
+        # Nothing locked yet or a hand left the crop, search the whole frame
+        with profiler.span("track"):
+            return self.model_hands.process(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+
     @contextmanager
     def track_results(self, frame):
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        self.results = self.model_hands.process(frame_rgb)
-
-        if self.results.multi_hand_landmarks:
-            for self.hand_type, self.hand_landmark in zip(self.results.multi_handedness, self.results.multi_hand_landmarks):
-                if self.overlay_hands_landmarks:
-                    self.mp_drawing_utils.draw_landmarks(
-                        frame,
-                        self.hand_landmark,
-                        self.mp_hands.HAND_CONNECTIONS,
-                        self.mp_drawing_utils.DrawingSpec(
-                            color=self.point_landmark_color,
-                            thickness=self.point_landmark_thickness,
-                            circle_radius=self.point_landmark_radius),
-                        self.mp_drawing_utils.DrawingSpec(
-                            color=self.line_landmark_color,
-                            thickness=self.line_landmark_thickness,
-                            circle_radius=self.line_landmark_radius))
+        self.swap_hands()
+
+        timestamp = time.perf_counter()
+
+        if self.external_results is not None or not self.adaptive_inference or \
+                self.inference_scheduler.should_infer(timestamp):
+            self.results = self.detect_hands(frame)
+            self.landmarks_tracked = True
+
+            self.hand_landmarks_array = self.results_landmarks()
+            self.inference_scheduler.observe(self.hand_landmarks_array,
+                                             timestamp,
+                                             time.perf_counter() - timestamp)
+
+        else:
+            # Between detections the hands keep moving at their last velocity
+            self.landmarks_tracked = False
+            self.hand_landmarks_array = self.inference_scheduler.extrapolate(
+                timestamp)
 
         yield frame
 
@@ -156,60 +463,53 @@ class Tracker(Camera):
         with self.track_results(frame):
             self.h, self.w, _ = frame.shape
 
-            self.landmarks_data = []
-
-            x_cur_list = []
-            y_cur_list = []
-
-            labeled_hand = {}
-
-            if self.results.multi_hand_landmarks:
-                for self.hand_landmarks in self.results.multi_hand_landmarks:
-                    for i in range(len(self.hand_landmarks.landmark)):
-                        x = self.hand_landmarks.landmark[i].x
-                        y = self.hand_landmarks.landmark[i].y
-
-                        x_cur_list.append(x)
-                        y_cur_list.append(y)
-
-                    for i in range(len(self.hand_landmarks.landmark)):
-                        x = self.hand_landmarks.landmark[i].x
-                        y = self.hand_landmarks.landmark[i].y
-                        self.landmarks_data.append(x - min(x_cur_list))
-                        self.landmarks_data.append(y - min(y_cur_list))
-
-                    self.x_min = int(min(x_cur_list) * self.w)
-                    self.y_min = int(min(y_cur_list) * self.h)
-
-                    self.x_max = int(max(x_cur_list) * self.w)
-                    self.y_max = int(max(y_cur_list) * self.h)
-
-                    if self.overlay_hands_type_label:
-                        if not self.cap_flip:
-                            if self.hand_type.classification[0].label == "Right":
-                                labeled_hand["type"] = "Left"
-                            else:
-                                labeled_hand["type"] = "Right"
-
-                        else:
-                            labeled_hand["type"] = self.hand_type.classification[0].label
-
-                        cv2.putText(frame,
-                                    labeled_hand["type"],
-                                    (self.x_min - self.labeled_hand_offset,
-                                        self.y_min - self.labeled_hand_offset),
-                                    cv2.FONT_HERSHEY_PLAIN,
-                                    2,
-                                    self.hand_type_label_color,
-                                    2)
-
-                    if self.overlay_hands_region:
-                        cv2.rectangle(frame,
-                                      (self.x_min - self.region_offset,
-                                       self.y_min - self.region_offset),
-                                      (self.x_max + self.region_offset,
-                                          self.y_max + self.region_offset),
-                                      self.region_landmark_color,
-                                      self.region_landmark_thickness)
+            self.hand_features = landmark_features(self.hand_landmarks_array)
+            self.hand_regions = hand_regions(self.hand_landmarks_array,
+                                             self.w,
+                                             self.h)
+
+            self.hand_labels = []
+            for self.hand_type in self.results.multi_handedness or []:
+                hand_label = self.hand_type.classification[0].label
+
+                # MediaPipe assumes a mirrored image
+                if not self.cap_flip:
+                    hand_label = "Left" if hand_label == "Right" else "Right"
+
+                self.hand_labels.append(hand_label)
 
             yield frame
+
+    def draw_overlay(self, renderer):
+        if not len(self.hand_regions):
+            return
+
+        if self.overlay_hands_landmarks:
+            renderer.add_hands(self.hand_landmarks_array[:, :, :2] * (self.w, self.h),
+                               self.line_landmark_color,
+                               self.line_landmark_thickness,
+                               self.point_landmark_color,
+                               self.point_landmark_radius,
+                               self.point_landmark_thickness)
+
+        for hand_label, (x_min, y_min, x_max, y_max) in zip(self.hand_labels, self.hand_regions):
+            if self.overlay_hands_type_label:
+                renderer.add_text(hand_label,
+                                  (x_min - self.labeled_hand_offset,
+                                   y_min - self.labeled_hand_offset),
+                                  self.hand_type_label_color)
+
+            if self.overlay_hands_region:
+                renderer.add_rectangle((x_min - self.region_offset,
+                                        y_min - self.region_offset),
+                                       (x_max + self.region_offset,
+                                        y_max + self.region_offset),
+                                       self.region_landmark_color,
+                                       self.region_landmark_thickness)
+
+    def render_overlay(self, frame, scale: float = 1.0, out=None):
+        # Cosmetics only, runs when someone watches the preview
+        with profiler.span("draw"):
+            self.draw_overlay(self.overlay_renderer)
+
+            return self.overlay_renderer.render(frame, scale, out)
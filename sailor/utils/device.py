@@ -1,8 +1,143 @@
-import device
+import os
+import re
+import time
+import glob
+import asyncio
+import logging
+import threading
 
-cap_index_list = []
-cap_device_list = []
+try:
+    import device
+except ImportError:
+    # The enumerator is Windows-only, elsewhere V4L2 nodes are probed instead
+    device = None
 
-for cap_index, cap_device in enumerate(device.getDeviceList()):
-    cap_index_list.append(cap_index)
-    cap_device_list.append(f"{cap_index} - {cap_device[0]}")
+
+logger = logging.getLogger(__name__)
+
+default_devices = [(0, "Default camera")]
+
+
+def probe_v4l2_devices():
+    devices = []
+
+    for node in glob.glob("/dev/video*"):
+        match = re.fullmatch(r"/dev/video(\d+)", node)
+        if match is None:
+            continue
+
+        cap_index = int(match.group(1))
+        sysfs_dir = f"/sys/class/video4linux/video{cap_index}"
+
+        try:
+            # UVC cameras also expose metadata nodes, only index 0 captures frames
+            with open(os.path.join(sysfs_dir, "index")) as index_file:
+                if int(index_file.read().strip() or 0) != 0:
+                    continue
+        except (OSError, ValueError):
+            pass
+
+        try:
+            with open(os.path.join(sysfs_dir, "name")) as name_file:
+                name = name_file.read().strip()
+        except OSError:
+            name = f"Video device {cap_index}"
+
+        devices.append((cap_index, name))
+
+    return sorted(devices)
+
+
+def enumerate_devices():
+    if device is not None:
+        # DirectShow enumeration can take seconds, callers keep it off the event loop
+        return [(cap_index, cap_device[0])
+                for cap_index, cap_device in enumerate(device.getDeviceList())]
+
+    return probe_v4l2_devices()
+
+
+def device_labels(devices):
+    return [f"{cap_index} - {name}" for cap_index, name in devices]
+
+
+class DeviceRegistry:
+    def __init__(self, ttl: float = 30.0, poll_interval: float = 0.0):
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+
+        self.devices = list(default_devices)
+        self.updated = None
+
+        self.lock = threading.Lock()
+        self.refreshed = threading.Event()
+        self.refresh_thread = None
+        self.poll_thread = None
+        self.poll_stop = threading.Event()
+
+    def is_stale(self):
+        return self.updated is None or time.perf_counter() - self.updated > self.ttl
+
+    def refresh(self):
+        # Concurrent callers share one enumeration instead of stacking them
+        with self.lock:
+            if self.refresh_thread is None:
+                self.refreshed.clear()
+                self.refresh_thread = threading.Thread(target=self.enumerate,
+                                                       name="sailor-devices",
+                                                       daemon=True)
+                self.refresh_thread.start()
+
+        return self.refreshed
+
+    def enumerate(self):
+        try:
+            devices = enumerate_devices() or list(default_devices)
+        except Exception:
+            logger.exception("An error occured while enumerating camera devices")
+            devices = self.devices
+
+        with self.lock:
+            self.devices = devices
+            self.updated = time.perf_counter()
+            self.refresh_thread = None
+
+        self.refreshed.set()
+
+    async def get_devices_async(self, force: bool = False):
+        if force or self.updated is None:
+            refreshed = self.refresh()
+            await asyncio.get_running_loop().run_in_executor(None, refreshed.wait)
+
+        elif self.is_stale():
+            # A stale list is served while the new one is enumerated
+            self.refresh()
+
+        return self.devices
+
+    def start_polling(self):
+        if self.poll_interval <= 0 or self.poll_thread is not None:
+            return
+
+        self.poll_stop.clear()
+        self.poll_thread = threading.Thread(target=self.poll_loop,
+                                            name="sailor-devices-poll",
+                                            daemon=True)
+        self.poll_thread.start()
+
+    def stop_polling(self):
+        if self.poll_thread is None:
+            return
+
+        self.poll_stop.set()
+        self.poll_thread.join(timeout=1)
+        self.poll_thread = None
+
+    def poll_loop(self):
+        # Hot-plugged cameras show up in the cache within one interval
+        while not self.poll_stop.is_set():
+            self.refresh().wait()
+            self.poll_stop.wait(self.poll_interval)
+
+
+device_registry = DeviceRegistry()
@@ -1,13 +1,61 @@
 import os
+import threading
 
 
-def find_path(file_name: str):
-    script_path = os.path.abspath(__file__)
-    root_dir = os.path.dirname(os.path.dirname(os.path.dirname(script_path)))
+project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-    for root, _, files in os.walk(root_dir):
-        if file_name in files:
-            file_path = os.path.join(root, file_name)
+# Searched in order, the first root holding the file wins
+search_roots = [project_root]
+
+skipped_dirs = {".git", "__pycache__", "node_modules", ".venv", "venv"}
+
+path_indexes = {}
+path_indexes_lock = threading.Lock()
+
+
+def add_search_root(root_dir: str):
+    root_dir = os.path.abspath(root_dir)
+
+    if root_dir not in search_roots:
+        search_roots.insert(0, root_dir)
+
+
+def build_index(root_dir: str):
+    index = {}
+
+    for root, dirs, files in os.walk(root_dir):
+        dirs[:] = [dir_name for dir_name in dirs if dir_name not in skipped_dirs]
+
+        for file_name in files:
+            # Keep the first match in walk order, like the old full scan did
+            index.setdefault(file_name, os.path.join(root, file_name))
+
+    return index
+
+
+def path_index(root_dir: str, rebuild: bool = False):
+    with path_indexes_lock:
+        if rebuild or root_dir not in path_indexes:
+            path_indexes[root_dir] = build_index(root_dir)
+
+        return path_indexes[root_dir]
+
+
+def find_path(file_name: str, roots=None):
+    roots = search_roots if roots is None else roots
+
+    for root_dir in roots:
+        # Files next to the root are the common case and need no index
+        file_path = os.path.join(root_dir, file_name)
+        if os.path.isfile(file_path):
             return file_path
 
+    for rebuild in (False, True):
+        for root_dir in roots:
+            file_path = path_index(root_dir, rebuild).get(file_name)
+
+            # A stale entry or a miss rescans once, files may have moved or appeared
+            if file_path is not None and os.path.isfile(file_path):
+                return file_path
+
     return None
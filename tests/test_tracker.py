@@ -0,0 +1,52 @@
+import numpy as np
+from types import SimpleNamespace
+
+from sailor.process.tracker import Tracker, num_landmarks, roi_box
+
+
+class RecordingHands:
+    def __init__(self):
+        self.shapes = []
+
+    def process(self, image):
+        self.shapes.append(image.shape)
+        return SimpleNamespace(multi_hand_landmarks=None, multi_handedness=None)
+
+
+def off_frame_tracker(landmarks):
+    # Only the state detect_hands reads, no camera or MediaPipe graph is opened
+    tracker = Tracker.__new__(Tracker)
+    tracker.external_results = None
+    tracker.hand_landmarks_array = landmarks
+    tracker.roi_inference = True
+    tracker.max_num_hands = 1
+    tracker.roi_padding = 0.5
+    tracker.roi_size = 256
+    tracker.model_hands = RecordingHands()
+
+    return tracker
+
+
+def test_roi_box_rejects_landmarks_outside_the_frame():
+    landmarks = np.full((1, num_landmarks, 3), 1.5, np.float32)
+
+    assert roi_box(landmarks, 640, 480, 0.5) is None
+
+
+def test_roi_box_stays_inside_the_frame():
+    landmarks = np.random.default_rng(0).uniform(-0.2, 0.4, (1, num_landmarks, 3))
+
+    x0, y0, x1, y1 = roi_box(landmarks.astype(np.float32), 640, 480, 0.5)
+
+    assert 0 <= x0 < x1 <= 640 and 0 <= y0 < y1 <= 480
+
+
+def test_detect_hands_falls_back_to_the_full_frame():
+    frame = np.zeros((480, 640, 3), np.uint8)
+
+    for offset in (1.2, 1.5, -0.5, 3.0):
+        tracker = off_frame_tracker(np.full((1, num_landmarks, 3), offset, np.float32))
+
+        tracker.detect_hands(frame)
+
+        assert tracker.model_hands.shapes == [frame.shape]